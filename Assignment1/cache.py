@@ -0,0 +1,100 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: Bounded caches with hit/miss/eviction counters
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# python imports
+
+from collections import OrderedDict
+
+
+class Cache(object):
+    ''' Bounded cache, evicts the oldest inserted entry first (FIFO) '''
+    def __init__(self, i_capacity=65536, f_quantum=None):
+        '''
+        @summary: constructor
+        @param i_capacity: maximum number of entries, None for unbounded
+        @param f_quantum: if given, float parts of a key are rounded to multiples of it,
+                          so that near-identical times share one entry
+        '''
+        super(Cache, self).__init__()
+        self.i_capacity  = i_capacity
+        self.f_quantum   = f_quantum
+        self.d_entries   = OrderedDict()
+        self.i_hits      = 0
+        self.i_misses    = 0
+        self.i_evictions = 0
+
+    def key(self, t_key):
+        ''' quantize the float parts of a tuple key '''
+        if self.f_quantum is None:
+            return t_key
+        return tuple(int(round(v / self.f_quantum)) if isinstance(v, float) else v for v in t_key)
+
+    def get(self, t_key, default=None):
+        '''
+        @summary: look up a key and count the hit or miss
+        @param t_key: tuple key
+        @param default: value returned on a miss
+        '''
+        t_key = self.key(t_key)
+        if t_key in self.d_entries:
+            self.i_hits += 1
+            self.touch(t_key)
+            return self.d_entries[t_key]
+        self.i_misses += 1
+        return default
+
+    def touch(self, t_key):
+        ''' hook called on every hit, nothing to do for FIFO '''
+        pass
+
+    def __setitem__(self, t_key, value):
+        t_key = self.key(t_key)
+        self.d_entries[t_key] = value
+        self.touch(t_key)
+        if self.i_capacity is not None:
+            while len(self.d_entries) > self.i_capacity:
+                self.d_entries.popitem(last=False)
+                self.i_evictions += 1
+
+    def __len__(self):
+        return len(self.d_entries)
+
+    def clear(self):
+        ''' drop all entries, keep the counters '''
+        self.d_entries.clear()
+
+    def stats(self):
+        ''' handy function to report the counters '''
+        i_lookups = self.i_hits + self.i_misses
+        return {'hits'      : self.i_hits,
+                'misses'    : self.i_misses,
+                'evictions' : self.i_evictions,
+                'size'      : len(self.d_entries),
+                'capacity'  : self.i_capacity,
+                'hit_rate'  : float(self.i_hits) / i_lookups if i_lookups else 0.}
+
+
+class LRUCache(Cache):
+    ''' Bounded cache, evicts the least recently used entry first '''
+    def touch(self, t_key):
+        ''' move the entry to the most recently used end '''
+        self.d_entries[t_key] = self.d_entries.pop(t_key)
+
+
+# eviction policies available to new_cache, register new Cache subclasses here
+d_policies = {'fifo': Cache, 'lru': LRUCache}
+
+
+def new_cache(s_policy='lru', i_capacity=65536, f_quantum=None):
+    '''
+    @summary: build a cache for the given eviction policy
+    @param s_policy: key of d_policies
+    @param i_capacity: maximum number of entries, None for unbounded
+    @param f_quantum: time quantum of the keys, None for exact keys
+    '''
+    if s_policy not in d_policies:
+        raise TypeError('The parameter s_policy can only be: ' + ', '.join(sorted(d_policies)))
+    return d_policies[s_policy](i_capacity, f_quantum)
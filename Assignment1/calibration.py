@@ -0,0 +1,320 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: OIS and LIBOR curve calibration compiled into exposure matrices
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# 3rd party imports
+
+import numpy as np
+import scipy.optimize as opt
+
+# local imports
+
+from splines import Spline
+from curves import OIS, LIBOR
+
+# singular values of the penalty-augmented Jacobian below F_RCOND times the largest are cut, the quotes
+# barely determine those directions and the discount factors are too far from linear along them
+F_RCOND = 1e-4
+
+
+class Calibration(object):
+    '''
+    Curve calibration with every cash-flow compiled once into basis-integral exposures.
+    The coefficient vector x holds the OIS coefficients followed by the LIBOR ones,
+    len(ls_knots) each. Every instrument is a ratio of two sums,
+        num = A_fwd . [(exp(G_fwd x) - 1) * exp(-G_pay x)]
+        den = A_ann . exp(-G_ann x)
+    where the rows of G_* are the integrals of the basis functions over one cash-flow
+    period, so that an objective evaluation is a handful of dense matrix products.
+    '''
+    def __init__(self, ls_knots, ls_swaps, ls_bswaps, ls_EDdates, f_EDtenor=0.25, f_time=0., ar_penalty=None, spl=None):
+        '''
+        @summary: constructor, walks every schedule once
+        @param ls_knots: a list of knots, shared by both curves
+        @param ls_swaps: list of Swap objects, quoted as par swap rates
+        @param ls_bswaps: list of BasisSwap objects, quoted as basis spreads
+        @param ls_EDdates: list of ED futures start dates, quoted as LIBOR forwards
+        @param f_EDtenor: tenor of the ED futures
+        @param f_time: settlement
+        @param ar_penalty: matrix P of the smoothness penalty x'Px of each curve, or None
+        @param spl: Spline object, built from ls_knots if not given
+        '''
+        super(Calibration, self).__init__()
+        self.ls_knots   = ls_knots
+        self.i_coefs    = len(ls_knots)
+        self.i_basis    = self.i_coefs - 4
+        self.spl        = spl if spl is not None else Spline(ls_knots)
+        self.ar_penalty = None if ar_penalty is None else np.asarray(ar_penalty, dtype=float)
+        self.ar_root    = None if ar_penalty is None else _root(self.ar_penalty)
+        self.i_swaps    = len(ls_swaps)
+        self.i_bswaps   = len(ls_bswaps)
+        self.i_EDs      = len(ls_EDdates)
+        self.ar_quotes  = None
+
+        # last optimum and its linearization, to warm start the next calibration
+        self.x_opt      = None
+        self.ar_pinv    = None
+
+        ls_fwd, ls_ann = [], []
+        i_instrument   = 0
+
+        # swaps: float leg against the fixed leg annuity
+        for swap in ls_swaps:
+            ar_starts, ar_ends, ar_accruals = swap.float_leg()
+            ls_fwd.append(self._terms(i_instrument, 1, ar_starts, ar_ends, ar_accruals/(ar_ends-ar_starts), ar_ends, f_time))
+            ar_starts, ar_ends, ar_accruals = swap.fixed_leg()
+            ls_ann.append(self._terms(i_instrument, 0, ar_ends, ar_ends, ar_accruals, ar_ends, f_time))
+            i_instrument += 1
+
+        # basis swaps: LIBOR minus OIS forwards against the OIS annuity
+        for bswap in ls_bswaps:
+            ar_starts, ar_ends, ar_accruals = bswap.fixed_leg()
+            ar_weights = ar_accruals/(ar_ends-ar_starts)
+            ls_fwd.append(self._terms(i_instrument, 1, ar_starts, ar_ends,  ar_weights, ar_ends, f_time))
+            ls_fwd.append(self._terms(i_instrument, 0, ar_starts, ar_ends, -ar_weights, ar_ends, f_time))
+            ls_ann.append(self._terms(i_instrument, 0, ar_ends, ar_ends, ar_accruals, ar_ends, f_time))
+            i_instrument += 1
+
+        # ED futures: a plain LIBOR forward, nothing to discount
+        for f_date in ls_EDdates:
+            ar_dates = np.array([f_date], dtype=float)
+            ls_fwd.append(self._terms(i_instrument, 1, ar_dates, ar_dates+f_EDtenor, np.array([1.0/f_EDtenor]), ar_dates, ar_dates))
+            ls_ann.append(self._terms(i_instrument, 0, ar_dates, ar_dates, np.ones(1), ar_dates, ar_dates))
+            i_instrument += 1
+
+        self.i_instruments = i_instrument
+        self.ar_Gfwd, self.ar_Gpay, self.ar_Afwd = self._stack(ls_fwd)
+        _,            self.ar_Gann, self.ar_Aann = self._stack(ls_ann)
+
+        # coefficients read by some quote or by the penalty, the others never move the objective
+        self.ar_active = np.any(self.ar_Gfwd != 0., axis=0) | np.any(self.ar_Gpay != 0., axis=0) | np.any(self.ar_Gann != 0., axis=0)
+        if self.ar_penalty is not None:
+            ar_used = np.any(self.ar_penalty != 0., axis=0) | np.any(self.ar_penalty != 0., axis=1)
+            self.ar_active |= np.concatenate([ar_used, ar_used])
+
+
+    def _terms(self, i_instrument, i_curve, ar_starts, ar_ends, ar_weights, ar_pays, ar_time):
+        '''
+        @summary: exposures of one leg
+        @param i_instrument: row of the instrument
+        @param i_curve: 0 for OIS, 1 for LIBOR, curve of the forward periods
+        @param ar_starts, ar_ends: forward periods
+        @param ar_weights: weight of every term
+        @param ar_pays: payment dates, discounted on OIS from ar_time
+        @return: (G_fwd, G_pay, instrument rows, weights)
+        '''
+        i_terms = len(ar_starts)
+        ar_Gfwd = np.zeros((i_terms, 2*self.i_coefs))
+        ar_Gpay = np.zeros((i_terms, 2*self.i_coefs))
+        i_begin = i_curve*self.i_coefs
+        ar_Gfwd[:, i_begin:i_begin+self.i_basis] = self.spl.splgamma_matrix(ar_starts, ar_ends)[:, :self.i_basis]
+        ar_Gpay[:, :self.i_basis]                = self.spl.splgamma_matrix(ar_time, ar_pays)[:, :self.i_basis]
+        return ar_Gfwd, ar_Gpay, np.repeat(i_instrument, i_terms), np.asarray(ar_weights, dtype=float)
+
+
+    def _stack(self, ls_terms):
+        ''' stack the legs and scatter the weights into an aggregation matrix '''
+        ar_G    = np.vstack([t[0] for t in ls_terms])
+        ar_Gpay = np.vstack([t[1] for t in ls_terms])
+        ar_rows = np.concatenate([t[2] for t in ls_terms])
+        ar_A    = np.zeros((self.i_instruments, len(ar_rows)))
+        ar_A[ar_rows, np.arange(len(ar_rows))] = np.concatenate([t[3] for t in ls_terms])
+        return ar_G, ar_Gpay, ar_A
+
+
+    def set_quotes(self, ls_swapRates, ls_basisRates, ls_EDRates):
+        '''
+        @summary: market quotes, in the order of the instruments given to the constructor
+        @param ls_swapRates: par swap rates
+        @param ls_basisRates: basis spreads, as rates
+        @param ls_EDRates: ED futures rates
+        '''
+        self.ar_quotes = np.concatenate([np.asarray(ls_swapRates, dtype=float),
+                                         np.asarray(ls_basisRates, dtype=float),
+                                         np.asarray(ls_EDRates, dtype=float)])
+
+
+    def model_rates(self, x):
+        ''' model rates of every instrument for coefficients x '''
+        x = np.asarray(x, dtype=float)
+        ar_num = self.ar_Afwd.dot((np.exp(self.ar_Gfwd.dot(x)) - 1.0) * np.exp(-self.ar_Gpay.dot(x)))
+        ar_den = self.ar_Aann.dot(np.exp(-self.ar_Gann.dot(x)))
+        return ar_num / ar_den
+
+
+    def model_jacobian(self, x):
+        '''
+        @summary: exact derivative of the model rates, chain rule through the exponentials
+        @param x: coefficients
+        @return: matrix of shape (instruments, 2*len(ls_knots))
+        '''
+        x = np.asarray(x, dtype=float)
+        ar_fwd = np.exp(self.ar_Gfwd.dot(x))
+        ar_pay = np.exp(-self.ar_Gpay.dot(x))
+        ar_ann = np.exp(-self.ar_Gann.dot(x))
+        ar_num = self.ar_Afwd.dot((ar_fwd - 1.0) * ar_pay)
+        ar_den = self.ar_Aann.dot(ar_ann)
+
+        # d num = A_fwd (e_fwd e_pay G_fwd - (e_fwd - 1) e_pay G_pay), d den = -A_ann e_ann G_ann
+        ar_dnum = self.ar_Afwd.dot((ar_fwd*ar_pay)[:, None] * self.ar_Gfwd - ((ar_fwd-1.0)*ar_pay)[:, None] * self.ar_Gpay)
+        ar_dden = -self.ar_Aann.dot(ar_ann[:, None] * self.ar_Gann)
+        return (ar_dnum - (ar_num/ar_den)[:, None] * ar_dden) / ar_den[:, None]
+
+
+    def residuals(self, x, b_penalty=False):
+        '''
+        @summary: model rates minus market quotes
+        @param x: coefficients
+        @param b_penalty: whether to append the penalty as residuals R x, with R'R = P,
+                          so that the sum of squares equals goal(x), for least squares solvers
+        '''
+        ar_res = self.model_rates(x) - self.ar_quotes
+        if b_penalty and self.ar_root is not None:
+            x = np.asarray(x, dtype=float)
+            ar_res = np.concatenate([ar_res, self.ar_root.dot(x[:self.i_coefs]), self.ar_root.dot(x[self.i_coefs:])])
+        return ar_res
+
+
+    def jacobian(self, x, b_penalty=False):
+        '''
+        @summary: exact Jacobian of residuals(x, b_penalty)
+        @param x: coefficients
+        @param b_penalty: whether to append the rows of the penalty residuals
+        '''
+        ar_jac = self.model_jacobian(x)
+        if b_penalty and self.ar_root is not None:
+            ar_zero = np.zeros_like(self.ar_root)
+            ar_jac  = np.vstack([ar_jac, np.hstack([self.ar_root, ar_zero]), np.hstack([ar_zero, self.ar_root])])
+        return ar_jac
+
+
+    def penalty(self, x):
+        ''' smoothness penalty of both curves '''
+        if self.ar_penalty is None:
+            return 0.
+        x = np.asarray(x, dtype=float)
+        x_ois, x_libor = x[:self.i_coefs], x[self.i_coefs:]
+        return x_ois.dot(self.ar_penalty).dot(x_ois) + x_libor.dot(self.ar_penalty).dot(x_libor)
+
+
+    def goal(self, x):
+        ''' objective function, sum of squared residuals plus the smoothness penalty '''
+        ar_res = self.residuals(x)
+        return ar_res.dot(ar_res) + self.penalty(x)
+
+
+    def gradient(self, x):
+        ''' exact gradient of the objective function '''
+        x      = np.asarray(x, dtype=float)
+        ar_res = self.residuals(x)
+        ar_grd = 2.0 * self.model_jacobian(x).T.dot(ar_res)
+        if self.ar_penalty is not None:
+            ar_sym = self.ar_penalty + self.ar_penalty.T
+            ar_grd[:self.i_coefs] += ar_sym.dot(x[:self.i_coefs])
+            ar_grd[self.i_coefs:] += ar_sym.dot(x[self.i_coefs:])
+        return ar_grd
+
+
+    def _full(self, x, ar_values):
+        ''' copy of the coefficients x with the active ones set to ar_values '''
+        x = np.array(x, dtype=float)
+        x[self.ar_active] = ar_values
+        return x
+
+
+    def calibrate(self, x0=None):
+        '''
+        @summary: Levenberg-Marquardt on the residuals, penalty included, then linearize at the optimum;
+                  only the active coefficients are fitted, the others keep their value from x0
+        @param x0: starting point, the last optimum if None, or 0.01 everywhere for the first calibration
+        @return: optimal coefficients
+        '''
+        if x0 is None:
+            x0 = self.x_opt if self.x_opt is not None else np.full(2*self.i_coefs, 0.01)
+        x0  = np.asarray(x0, dtype=float)
+        res = opt.least_squares(lambda z: self.residuals(self._full(x0, z), b_penalty=True), x0[self.ar_active],
+                                jac = lambda z: self.jacobian(self._full(x0, z), b_penalty=True)[:, self.ar_active], method = 'lm')
+        self.linearize(self._full(x0, res.x))
+        return self.x_opt
+
+
+    def recalibrate(self, ls_swapRates, ls_basisRates, ls_EDRates, f_smallMove=1e-4):
+        '''
+        @summary: calibrate to new quotes from the last optimum, with one Gauss-Newton step when no quote
+                  moved more than f_smallMove since the last call and the step lowers the objective,
+                  else Levenberg-Marquardt from there
+        @param ls_swapRates, ls_basisRates, ls_EDRates: new quotes, as set_quotes
+        @param f_smallMove: largest quote move, in rate, still handled by a single step
+        @return: optimal coefficients
+        '''
+        ar_old = self.ar_quotes
+        self.set_quotes(ls_swapRates, ls_basisRates, ls_EDRates)
+        if self.x_opt is None:
+            return self.calibrate()
+
+        if ar_old is not None and np.max(np.abs(self.ar_quotes - ar_old)) <= f_smallMove:
+            # step -(J'J + R'R)^+ J' r on the active coefficients, with the Jacobian of the last full calibration
+            x_step = self._full(self.x_opt, self.x_opt[self.ar_active] - self.ar_pinv.dot(self.residuals(self.x_opt, b_penalty=True)))
+            if self.goal(x_step) <= self.goal(self.x_opt):
+                self.x_opt = x_step
+                return self.x_opt
+        return self.calibrate()
+
+
+    def linearize(self, x, f_rcond=F_RCOND):
+        '''
+        @summary: keep x as the last optimum with the pseudo-inverse of the penalty-augmented Jacobian on the
+                  active coefficients, which maps residuals to Gauss-Newton steps
+        @param x: coefficients
+        @param f_rcond: relative cut of the singular values, see F_RCOND
+        '''
+        ar_jac       = self.jacobian(x, b_penalty=True)[:, self.ar_active]
+        self.x_opt   = np.array(x, dtype=float)
+        self.ar_pinv = np.linalg.pinv(ar_jac, rcond=f_rcond)
+
+
+    def snapshots(self, x=None):
+        '''
+        @summary: frozen OIS and LIBOR curves of a coefficient vector, for repeated queries
+        @param x: coefficients, the last optimum if None
+        @return: (ois, libor) as CurveSnapshot objects
+        '''
+        x = self.x_opt if x is None else np.asarray(x, dtype=float)
+        return OIS(self.ls_knots, x[:self.i_coefs]).snapshot(self.spl), \
+               LIBOR(self.ls_knots, x[self.i_coefs:]).snapshot(self.spl)
+
+
+    def quote_sensitivities(self, x, f_rcond=F_RCOND):
+        '''
+        @summary: derivatives of the calibrated coefficients to the market quotes, implicit function theorem
+                  on the first order condition J'(m(x) - q) + R'R x = 0 with the Gauss-Newton Hessian,
+                  dx/dq = (J'J + R'R)^+ J', i.e. the first columns of the truncated pseudo-inverse of
+                  jacobian(x, True) on the active coefficients; x must be a first order optimum, e.g. from calibrate
+        @param x: calibrated coefficients
+        @param f_rcond: relative cut of the singular values, see F_RCOND
+        @return: matrix of shape (2*len(ls_knots), instruments), in the order of set_quotes; directions the
+                 quotes do not determine (cut singular values, coefficients no instrument reads) get zero sensitivity
+        '''
+        ar_jac  = self.jacobian(x, b_penalty=True)[:, self.ar_active]
+        ar_sens = np.zeros((2*self.i_coefs, self.i_instruments))
+        ar_sens[self.ar_active] = np.linalg.pinv(ar_jac, rcond=f_rcond)[:, :self.i_instruments]
+        return ar_sens
+
+
+    def quote_risk(self, x, ar_dPVs, f_rcond=F_RCOND):
+        '''
+        @summary: derivatives of PVs to the market quotes, without recalibrating
+        @param x: calibrated coefficients, a first order optimum
+        @param ar_dPVs: derivatives of the PVs to the coefficients, e.g. from SwapPortfolio.gradient
+        @param f_rcond: relative cut of the singular values, see F_RCOND
+        @return: matrix of shape (trades, instruments), per unit of quote, times 1e-4 for a basis point
+        '''
+        return np.asarray(ar_dPVs, dtype=float).dot(self.quote_sensitivities(x, f_rcond))
+
+
+def _root(ar_penalty):
+    ''' square root R of the symmetric part of a penalty matrix, R'R = (P + P')/2 '''
+    ar_eigval, ar_eigvec = np.linalg.eigh(0.5 * (ar_penalty + ar_penalty.T))
+    return np.sqrt(np.clip(ar_eigval, 0., None))[:, None] * ar_eigvec.T
@@ -4,9 +4,9 @@ Description: OIS and LIBOR curves
 Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
 """
 
-# python imports
+# 3rd party imports
 
-import math
+import numpy as np
 
 # local imports
 
@@ -24,21 +24,154 @@ class Curve(object):
         self.ls_knots = ls_knots
         self.ls_coefs = ls_coefs
 
+    def banded(self, spl):
+        '''
+        @summary: coefficients laid out for the local evaluation of spl, rebuilt on every call (O(len(ls_coefs)))
+                  so that changes to ls_coefs in place are always seen
+        @param spl: spline object to access function
+        @return: (ar_coefs, ar_cumint), ar_coefs padded with 3 zeros before and 4 after so that the
+                 4 active basis functions of any time index it as ar_first+3+k, ar_cumint[i] the integral over
+                 the whole line of the first i basis functions
+        '''
+        i_splines = len(spl.ar_knots) - 4
+        i_basis   = min(len(self.ls_coefs) - 4, i_splines)
+        ar_coefs  = np.zeros(i_splines + 7)
+        ar_coefs[3:3+i_basis] = np.asarray(self.ls_coefs[:i_basis], dtype=float)
+        ar_total  = (spl.ar_knots[4:] - spl.ar_knots[:-4]) / 4.
+        ar_cumint = np.concatenate([[0.], np.cumsum(ar_coefs[3:-4] * ar_total)])
+        return ar_coefs, ar_cumint
+
+    def dr(self, f_time, spl, i_order=1):
+        '''
+        @summary: derivative of the instantaneous rate, slope for i_order=1 and convexity for i_order=2
+        @param f_time: time point, or an array of time points
+        @param spl: spline object to access function
+        @param i_order: order of the derivative
+        '''
+        ar_coefs = self.banded(spl)[0][3:-4]
+        ar_dr    = spl.splder_matrix(f_time, 3, i_order).dot(ar_coefs)
+        return ar_dr if np.ndim(f_time) else ar_dr[0]
+
+    def integral(self, f_time, spl):
+        '''
+        @summary: integral of the instantaneous rate from -inf, basis functions fully passed come from
+                  the cumulative integral and only the 4 active ones are evaluated
+        @param f_time: time point, or an array of time points
+        @param spl: spline object to access function
+        '''
+        ar_coefs, ar_cumint = self.banded(spl)
+        ar_first, ar_ints = spl.splint_active(f_time, 3)
+        return ar_cumint[np.maximum(ar_first, 0)] + (ar_ints * ar_coefs[ar_first[:, None] + 3 + np.arange(4)]).sum(axis=1)
+
     def r(self, f_time, spl):
         '''
         @summary: compute the instantaneous rate
-        @param f_time: time point 
+        @param f_time: time point, or an array of time points
         @param spl: spline object to access function
         '''
-        return sum([self.ls_coefs[i]*spl.splrep(i,3,f_time) for i in range(0, len(self.ls_coefs)-4)])
+        ar_coefs = self.banded(spl)[0]
+        ar_first, ar_values = spl.splactive(f_time, 3)
+        ar_rates = (ar_values * ar_coefs[ar_first[:, None] + 3 + np.arange(4)]).sum(axis=1)
+        return ar_rates if np.ndim(f_time) else ar_rates[0]
+
+    def gamma(self, f_start, f_end, spl):
+        '''
+        @summary: integral of the instantaneous rate between two dates
+        @param f_start: start time, or an array of start times
+        @param f_end: end time, or an array of end times
+        @param spl: spline object to access function
+        '''
+        ar_start, ar_end = np.broadcast_arrays(np.atleast_1d(np.asarray(f_start, dtype=float)),
+                                               np.atleast_1d(np.asarray(f_end,   dtype=float)))
+        ar_ints  = self.integral(np.concatenate([ar_end.ravel(), ar_start.ravel()]), spl)
+        ar_gamma = (ar_ints[:ar_end.size] - ar_ints[ar_end.size:]).reshape(ar_end.shape)
+        return ar_gamma if np.ndim(f_start) or np.ndim(f_end) else ar_gamma[0]
+
+    def gamma_jacobian(self, f_start, f_end, spl):
+        '''
+        @summary: derivatives of gamma to the coefficients, zero for the trailing ones gamma does not read
+        @param f_start: start time, or an array of start times
+        @param f_end: end time, or an array of end times
+        @param spl: spline object to access function
+        @return: matrix of shape (dates, len(ls_coefs))
+        '''
+        i_basis  = len(self.ls_coefs) - 4
+        ar_gamma = spl.splgamma_matrix(f_start, f_end)[:, :i_basis]
+        return np.hstack([ar_gamma, np.zeros((len(ar_gamma), len(self.ls_coefs)-i_basis))])
 
     def disc_factor(self, f_start, f_end, spl):
         ''' computes the discount factor between any two dates '''
-        return math.exp(-sum([self.ls_coefs[i]*spl.splgamma(i,f_start,f_end) for i in range(0, len(self.ls_coefs)-4)]))
+        return np.exp(-self.gamma(f_start, f_end, spl))
 
     def forwards(self, f_start, f_end, spl):
         ''' computes the forward rates between any two dates '''
-        return (math.exp(sum([self.ls_coefs[i] * spl.splgamma(i,f_start,f_end) for i in range(0, len(self.ls_coefs)-4)])) - 1.0) / (f_end-f_start)
+        return (np.exp(self.gamma(f_start, f_end, spl)) - 1.0) / np.subtract(f_end, f_start)
+
+    def snapshot(self, spl):
+        '''
+        @summary: freeze the curve into its piecewise-polynomial form
+        @param spl: spline object to access function
+        @return: CurveSnapshot, independent of spl and of later changes to the curve
+        '''
+        ar_coefs = self.banded(spl)[0][3:-4]
+        ar_poly, ar_int = spl.splppoly(3)
+        return CurveSnapshot(spl.ar_knots, np.einsum('sbk,b->sk', ar_poly, ar_coefs), np.einsum('sbk,b->sk', ar_int, ar_coefs))
+
+
+class CurveSnapshot(object):
+    '''
+    Frozen curve, r(t) and its integral from -inf as one polynomial per knot span in the local
+    variable t - t_span, plus a flat span before the first knot and one after the last knot.
+    A query is a binary search and a Horner step on read-only arrays: no spline, no caches.
+    '''
+    def __init__(self, ar_knots, ar_rate, ar_int):
+        '''
+        @summary: constructor
+        @param ar_knots: increasing knots
+        @param ar_rate: coefficients of r on every span, shape (len(ar_knots)-1, 4), increasing powers
+        @param ar_int: coefficients of the integral of r from -inf on every span, shape (len(ar_knots)-1, 5)
+        '''
+        super(CurveSnapshot, self).__init__()
+        self.ar_knots = np.array(ar_knots, dtype=float)
+        f_width = self.ar_knots[-1] - self.ar_knots[-2]
+        f_total = np.polyval(np.asarray(ar_int[-1])[::-1], f_width)
+
+        # row 0 before the first knot, row i the span [t_{i-1}, t_i), the last row past the last knot
+        self.ar_origin = np.concatenate([self.ar_knots[:1], self.ar_knots])
+        self.ar_rate   = np.zeros((len(self.ar_knots)+1, 4))
+        self.ar_int    = np.zeros((len(self.ar_knots)+1, 5))
+        self.ar_rate[1:-1] = ar_rate
+        self.ar_int[1:-1]  = ar_int
+        self.ar_int[-1, 0] = f_total
+        for ar in (self.ar_knots, self.ar_origin, self.ar_rate, self.ar_int):
+            ar.flags.writeable = False
+
+    def _horner(self, ar_table, ar_times):
+        ''' value of the polynomial of the span of every time, accumulated in place '''
+        ar_times = np.asarray(ar_times, dtype=float)
+        ar_spans = np.searchsorted(self.ar_knots, ar_times, side='right')
+        ar_x     = ar_times - self.ar_origin[ar_spans]
+        ar_sum   = ar_table[ar_spans, -1]
+        for i_k in range(ar_table.shape[1]-2, -1, -1):
+            ar_sum *= ar_x
+            ar_sum += ar_table[ar_spans, i_k]
+        return ar_sum
+
+    def instantaneous(self, ar_times):
+        ''' instantaneous rate r(t) '''
+        return self._horner(self.ar_rate, ar_times)
+
+    def integral(self, ar_times):
+        ''' integral of the instantaneous rate from -inf '''
+        return self._horner(self.ar_int, ar_times)
+
+    def discount(self, ar_times, f_start=0.):
+        ''' discount factors from f_start to every time, as Curve.disc_factor '''
+        return np.exp(self.integral(f_start) - self.integral(ar_times))
+
+    def forward(self, ar_start, ar_end):
+        ''' simple forward rates between two dates, as Curve.forwards '''
+        return np.expm1(self.integral(ar_end) - self.integral(ar_start)) / np.subtract(ar_end, ar_start)
 
 
 class OIS(Curve):
@@ -0,0 +1,175 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: Binary curve set files, memory-mapped read-only, and a registry of them
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# python imports
+
+import hashlib
+import os
+import time
+
+# 3rd party imports
+
+import numpy as np
+
+# local imports
+
+from splines import Spline
+from curves import Curve, CurveSnapshot, OIS, LIBOR
+
+S_MAGIC     = b'IRCURVE1'
+S_EXTENSION = '.curves'
+
+# curve classes by name, any other name is read back as a plain Curve
+d_classes = {'OIS': OIS, 'LIBOR': LIBOR}
+
+# fixed part of every file: magic, number of knots, number of curves, bytes per curve name, calibration time, quote hash
+dt_header = np.dtype([('magic', 'S8'), ('knots', '<i8'), ('curves', '<i8'), ('width', '<i8'), ('stamp', '<f8'),
+                      ('hash', 'S32')], align=True)
+
+
+def _layout(i_knots, i_curves, i_width):
+    ''' record of a file with i_curves curves on i_knots knots and names of i_width bytes, fields aligned to 8 bytes '''
+    return np.dtype(dt_header.descr + [('names', 'S%d' % i_width, (i_curves,)),
+                                       ('knot',  '<f8', (i_knots,)),
+                                       ('coefs', '<f8', (i_curves, i_knots)),
+                                       ('rate',  '<f8', (i_curves, i_knots-1, 4)),
+                                       ('int',   '<f8', (i_curves, i_knots-1, 5))], align=True)
+
+
+def quote_hash(ar_quotes):
+    ''' md5 of the quotes a curve set was calibrated to, e.g. Calibration.ar_quotes '''
+    return hashlib.md5(np.ascontiguousarray(ar_quotes, dtype='<f8').tobytes()).hexdigest()
+
+
+def write_curves(s_filename, ls_knots, d_coefs, ar_quotes=None, f_stamp=None):
+    '''
+    @summary: write a curve set, to a temporary file first so that readers never see a partial one
+    @param s_filename: path of the file
+    @param ls_knots: knots shared by every curve
+    @param d_coefs: OrderedDict curve name (ascii, any length) -> coefficients, len(ls_knots) each
+    @param ar_quotes: quotes of the calibration, hashed into the header, or None
+    @param f_stamp: calibration time in seconds since the epoch, now if None
+    '''
+    ls_names = [s_name.encode('ascii') for s_name in d_coefs]
+    i_width  = max([len(s_name) for s_name in ls_names] + [1])
+    spl      = Spline(ls_knots)
+    ar_record = np.zeros(1, dtype=_layout(len(ls_knots), len(d_coefs), i_width))[0]
+    ar_record['magic']  = S_MAGIC
+    ar_record['knots']  = len(ls_knots)
+    ar_record['curves'] = len(d_coefs)
+    ar_record['width']  = i_width
+    ar_record['stamp']  = time.time() if f_stamp is None else f_stamp
+    ar_record['hash']   = '' if ar_quotes is None else quote_hash(ar_quotes)
+    ar_record['knot']   = ls_knots
+    for i, (s_name, ar_coefs) in enumerate(d_coefs.items()):
+        snapshot = Curve(ls_knots, ar_coefs).snapshot(spl)
+        ar_record['names'][i] = ls_names[i]
+        ar_record['coefs'][i] = ar_coefs
+        ar_record['rate'][i]  = snapshot.ar_rate[1:-1]
+        ar_record['int'][i]   = snapshot.ar_int[1:-1]
+
+    s_temp = '%s.%d.tmp' % (s_filename, os.getpid())
+    with open(s_temp, 'wb') as f:
+        f.write(ar_record.tobytes())
+    os.rename(s_temp, s_filename)
+
+
+def read_curves(s_filename):
+    ''' handy function to map a curve set file, see CurveSet '''
+    return CurveSet(s_filename)
+
+
+class CurveSet(object):
+    '''
+    Curve set file mapped read-only: every process reading the same file shares its pages,
+    the knots and coefficients are views on the mapping and nothing is recalibrated.
+    '''
+    def __init__(self, s_filename):
+        '''
+        @summary: constructor, checks the header and maps the whole file
+        @param s_filename: path of the file
+        '''
+        super(CurveSet, self).__init__()
+        ar_header = np.fromfile(s_filename, dtype=dt_header, count=1)
+        if len(ar_header) == 0 or ar_header[0]['magic'] != S_MAGIC:
+            raise TypeError('The file %s is not a curve set' % s_filename)
+        i_knots, i_curves, i_width = int(ar_header[0]['knots']), int(ar_header[0]['curves']), int(ar_header[0]['width'])
+
+        self.s_filename = s_filename
+        self.ar_record  = np.memmap(s_filename, dtype=_layout(i_knots, i_curves, i_width), mode='r', shape=(1,))[0]
+        self.f_stamp    = float(self.ar_record['stamp'])
+        self.s_hash     = self.ar_record['hash'].decode('ascii')
+        self.ar_knots   = self.ar_record['knot']
+        self.ls_names   = [s.decode('ascii') for s in self.ar_record['names']]
+        self.d_index    = dict((s_name, i) for i, s_name in enumerate(self.ls_names))
+
+    def index(self, s_name):
+        ''' position of a curve in the file '''
+        if s_name not in self.d_index:
+            raise TypeError('The parameter s_name can only be: ' + ', '.join(self.ls_names))
+        return self.d_index[s_name]
+
+    def coefs(self, s_name):
+        ''' coefficients of a curve, a read-only view on the file '''
+        return self.ar_record['coefs'][self.index(s_name)]
+
+    def curve(self, s_name):
+        ''' the curve as OIS, LIBOR or Curve object, to use with a Spline on ar_knots '''
+        return d_classes.get(s_name, Curve)(list(self.ar_knots), self.coefs(s_name))
+
+    def snapshot(self, s_name):
+        ''' the curve as CurveSnapshot, built from the stored polynomial tables without a Spline '''
+        i_curve = self.index(s_name)
+        return CurveSnapshot(self.ar_knots, self.ar_record['rate'][i_curve], self.ar_record['int'][i_curve])
+
+
+class CurveRegistry(object):
+    '''
+    Directory of curve set files, one sub-directory per name and one file per calibration,
+    named by its UTC calibration time so that sorting the names sorts the calibrations.
+    '''
+    def __init__(self, s_root):
+        '''
+        @summary: constructor
+        @param s_root: root directory, created on the first publish
+        '''
+        super(CurveRegistry, self).__init__()
+        self.s_root = s_root
+
+    def publish(self, s_name, ls_knots, d_coefs, ar_quotes=None, f_stamp=None):
+        '''
+        @summary: store a calibrated curve set, arguments as write_curves
+        @param s_name: name of the curve set, e.g. a currency
+        @return: path of the new file
+        '''
+        f_stamp = time.time() if f_stamp is None else f_stamp
+        s_dir   = os.path.join(self.s_root, s_name)
+        if not os.path.isdir(s_dir):
+            os.makedirs(s_dir)
+        s_time     = time.strftime('%Y%m%dT%H%M%S', time.gmtime(f_stamp)) + '%06d' % int(round((f_stamp % 1) * 1e6) % 1000000)
+        s_filename = os.path.join(s_dir, s_time + S_EXTENSION)
+        write_curves(s_filename, ls_knots, d_coefs, ar_quotes, f_stamp)
+        return s_filename
+
+    def history(self, s_name):
+        ''' paths of every curve set of a name, oldest first '''
+        s_dir = os.path.join(self.s_root, s_name)
+        if not os.path.isdir(s_dir):
+            return []
+        return [os.path.join(s_dir, s) for s in sorted(os.listdir(s_dir)) if s.endswith(S_EXTENSION)]
+
+    def latest(self, s_name, s_date=None):
+        '''
+        @summary: most recent curve set of a name
+        @param s_name: name of the curve set
+        @param s_date: 'YYYY-MM-DD', only calibrations of that UTC day or before count, all if None
+        @return: CurveSet, or None if there is none
+        '''
+        ls_files = self.history(s_name)
+        if s_date is not None:
+            s_day    = s_date.replace('-', '')
+            ls_files = [s for s in ls_files if os.path.basename(s)[:8] <= s_day]
+        return CurveSet(ls_files[-1]) if ls_files else None
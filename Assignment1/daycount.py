@@ -0,0 +1,83 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: Day count conventions on datetime64 arrays
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# 3rd party imports
+
+import numpy as np
+
+# supported conventions
+ls_conventions = ['ACT/360', 'ACT/365F', '30/360', 'ACT/ACT']
+
+
+def to_dates(dates):
+    '''
+    @summary: dates as a datetime64[D] array, calendar days only so no timezone is involved
+    @param dates: datetime, Timestamp, string, datetime64 or any sequence or Series of them
+    @return: array of datetime64[D], a scalar input gives a 0-d array
+    '''
+    ar_dates = np.asarray(dates)
+    if ar_dates.dtype == object:
+        ar_dates = np.array([np.datetime64(d.isoformat()[:10]) if hasattr(d, 'isoformat') else d
+                             for d in ar_dates.ravel()], dtype='datetime64[D]').reshape(ar_dates.shape)
+    return ar_dates.astype('datetime64[D]')
+
+
+def ymd(dates):
+    '''
+    @summary: calendar fields of dates
+    @param dates: anything to_dates takes
+    @return: (ar_years, ar_months, ar_days) as integer arrays
+    '''
+    ar_dates  = to_dates(dates)
+    ar_months = ar_dates.astype('datetime64[M]')
+    ar_years  = ar_dates.astype('datetime64[Y]').astype(int) + 1970
+    return ar_years, ar_months.astype(int) % 12 + 1, (ar_dates - ar_months).astype(int) + 1
+
+
+def year_length(ar_years):
+    ''' number of days of the given years '''
+    ar_years = np.asarray(ar_years)
+    return np.where((ar_years % 4 == 0) & ((ar_years % 100 != 0) | (ar_years % 400 == 0)), 366.0, 365.0)
+
+
+def to_year(dates):
+    '''
+    @summary: fractional year of dates, the year plus the days elapsed over the days of that year
+    @param dates: anything to_dates takes
+    @return: float array, or a float for a scalar input
+    '''
+    ar_dates = to_dates(dates)
+    ar_years = ar_dates.astype('datetime64[Y]')
+    ar_frac  = (ar_dates - ar_years).astype(float) / year_length(ar_years.astype(int) + 1970)
+    ar_year  = ar_years.astype(int) + 1970 + ar_frac
+    return float(ar_year) if ar_year.ndim == 0 else ar_year
+
+
+def year_fraction(start, end, s_convention='ACT/ACT'):
+    '''
+    @summary: accrual year fractions between dates, broadcast over arrays
+    @param start: start dates, anything to_dates takes
+    @param end: end dates, anything to_dates takes
+    @param s_convention: one of ls_conventions, ACT/ACT is the ISDA one (days of every year over its length)
+                         and 30/360 is the bond basis
+    @return: float array, or a float for scalar inputs
+    '''
+    if s_convention not in ls_conventions:
+        raise TypeError('The parameter s_convention can only be: ' + ', '.join(ls_conventions))
+
+    if s_convention == 'ACT/ACT':
+        ar_frac = to_year(end) - to_year(start)
+    elif s_convention == '30/360':
+        ar_y1, ar_m1, ar_d1 = ymd(start)
+        ar_y2, ar_m2, ar_d2 = ymd(end)
+        ar_d1 = np.minimum(ar_d1, 30)
+        ar_d2 = np.where(ar_d1 == 30, np.minimum(ar_d2, 30), ar_d2)
+        ar_frac = (360.0*(ar_y2-ar_y1) + 30.0*(ar_m2-ar_m1) + (ar_d2-ar_d1)) / 360.0
+    else:
+        ar_days = (to_dates(end) - to_dates(start)).astype(float)
+        ar_frac = ar_days / (360.0 if s_convention == 'ACT/360' else 365.0)
+    ar_frac = np.asarray(ar_frac, dtype=float)
+    return float(ar_frac) if ar_frac.ndim == 0 else ar_frac
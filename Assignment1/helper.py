@@ -4,41 +4,141 @@ Description: Helper functions for main file
 Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
 """
 
+# python imports
+
+import hashlib
+import os
+from collections import OrderedDict
+
 # 3rd party imports
 
+import numpy as np
 import pandas as pd
-from datetime import datetime as dt
-import time
+import xlrd
+
+# local imports
+
+import daycount
+
+# instrument blocks of the curve sheet
+ls_blocks = ['LIBOR', 'ED Futures', 'Swap Rates', 'Fed Funds', 'Basis Swap Rates']
+
+# parsed workbooks of this process, keyed by (path, mtime, size)
+d_sheets = {}
 
-def read_DataSheetCurve(s_type):
+
+def read_DataSheetCurve(s_type, s_filename='DataSheetCurve.xls'):
     ''' handy function to read given excel '''
-    s_filename = 'DataSheetCurve.xls'
-    s_sheetname = '3M LIBOR  OIS'
-    if s_type == 'LIBOR':
-        return pd.read_excel(s_filename, s_sheetname, skiprows=1,  parse_cols='B:E')[:2]
-    elif s_type == 'ED Futures':
-        return pd.read_excel(s_filename, s_sheetname, skiprows=5,  parse_cols='B:F')[:8]
-    elif s_type == 'Swap Rates':
-        return pd.read_excel(s_filename, s_sheetname, skiprows=15, parse_cols='B:E')[:11]
-    elif s_type == 'Fed Funds':
-        return pd.read_excel(s_filename, s_sheetname, skiprows=28, parse_cols='B:E')[:1]
-    elif s_type == 'Basis Swap Rates':
-        return pd.read_excel(s_filename, s_sheetname, skiprows=32, parse_cols='B:E')[:16]
-    else:
+    if s_type not in ls_blocks:
         raise TypeError('The paramter s_type can only be: LIBOR, ED Futures, Swap Rates, Fed Funds or Basis Swap Rates')
+    return pd.DataFrame(load_DataSheetCurve(s_filename)[s_type])
 
-def toYearFraction(date):
-    ''' convert datetime object to fractional year '''
-    def sinceEpoch(date): # returns seconds since epoch
-        return time.mktime(date.timetuple())
-    s = sinceEpoch
 
-    year = date.year
-    startOfThisYear = dt(year=year, month=1, day=1)
-    startOfNextYear = dt(year=year+1, month=1, day=1)
+def load_DataSheetCurve(s_filename='DataSheetCurve.xls', b_cache=True):
+    '''
+    @summary: every instrument block of the curve sheet as typed arrays, the workbook is parsed once and
+              kept in a .curvecache.npz next to it, keyed by the md5 of its content
+    @param s_filename: path of the workbook
+    @param b_cache: whether to read and write the npz cache
+    @return: OrderedDict block -> OrderedDict column -> array, dates as datetime64[D], numbers as float
+    '''
+    s_path = os.path.abspath(s_filename)
+    t_stat = os.stat(s_path)
+    t_key  = (s_path, t_stat.st_mtime, t_stat.st_size)
+    if t_key in d_sheets:
+        return d_sheets[t_key]
+
+    with open(s_path, 'rb') as f:
+        s_content = f.read()
+    s_md5   = hashlib.md5(s_content).hexdigest()
+    s_cache = os.path.splitext(s_path)[0] + '.curvecache.npz'
+
+    d_sheet = None
+    if b_cache and os.path.exists(s_cache):
+        d_sheet = _read_cache(s_cache, s_md5)
+    if d_sheet is None:
+        d_sheet = _parse_workbook(s_content)
+        if b_cache:
+            _write_cache(s_cache, s_md5, d_sheet)
+    d_sheets[t_key] = d_sheet
+    return d_sheet
+
 
-    yearElapsed = s(date) - s(startOfThisYear)
-    yearDuration = s(startOfNextYear) - s(startOfThisYear)
-    fraction = yearElapsed/yearDuration
+def load_DataSheetCurves(ls_filenames, b_cache=True):
+    '''
+    @summary: bulk loading of historical snapshots, each parsed once and cached as load_DataSheetCurve
+    @param ls_filenames: paths of the workbooks
+    @param b_cache: whether to read and write the npz caches
+    @return: OrderedDict block -> OrderedDict column -> array of shape (snapshots, rows) when every
+             snapshot has the same rows in that block, else a list with one array per snapshot
+    '''
+    ls_sheets = [load_DataSheetCurve(s_filename, b_cache) for s_filename in ls_filenames]
+    d_stacked = OrderedDict()
+    for s_block, d_columns in ls_sheets[0].items():
+        d_stacked[s_block] = OrderedDict()
+        for s_column in d_columns:
+            ls_arrays = [d_sheet[s_block][s_column] for d_sheet in ls_sheets]
+            b_same    = len(set(ar.shape for ar in ls_arrays)) == 1
+            d_stacked[s_block][s_column] = np.stack(ls_arrays) if b_same else ls_arrays
+    return d_stacked
 
-    return date.year + fraction
\ No newline at end of file
+
+def _parse_workbook(s_content, s_sheetname='3M LIBOR  OIS'):
+    ''' split the curve sheet into blocks, a block starts at a title in column A and ends at an empty row '''
+    book  = xlrd.open_workbook(file_contents=s_content)
+    sheet = book.sheet_by_name(s_sheetname)
+    d_sheet = OrderedDict()
+    i_row = 0
+    while i_row < sheet.nrows:
+        s_block = sheet.cell_value(i_row, 0)
+        if not s_block:
+            i_row += 1
+            continue
+        ls_header = [sheet.cell_value(i_row, j) for j in range(1, sheet.ncols)]
+        i_cols = max(j for j, s in enumerate(ls_header) if s) + 1
+        i_end  = i_row + 1
+        while i_end < sheet.nrows and sheet.cell_type(i_end, 1) != xlrd.XL_CELL_EMPTY:
+            i_end += 1
+        d_sheet[s_block] = OrderedDict((ls_header[j] or 'Instrument', _column(sheet.col_slice(j+1, i_row+1, i_end), book.datemode))
+                                       for j in range(i_cols))
+        i_row = i_end
+    return d_sheet
+
+
+def _column(ls_cells, i_datemode):
+    ''' typed array of a column of cells '''
+    ls_types = set(cell.ctype for cell in ls_cells) - set([xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK])
+    if ls_types == set([xlrd.XL_CELL_DATE]):
+        d_epoch = np.datetime64('1904-01-01' if i_datemode else '1899-12-30', 'D')
+        return np.array([d_epoch + np.timedelta64(int(cell.value), 'D') if cell.value != '' else np.datetime64('NaT')
+                         for cell in ls_cells], dtype='datetime64[D]')
+    if ls_types <= set([xlrd.XL_CELL_NUMBER]):
+        return np.array([cell.value if cell.value != '' else np.nan for cell in ls_cells], dtype=float)
+    return np.array([u'%s' % cell.value for cell in ls_cells], dtype=np.unicode_)
+
+
+def _read_cache(s_cache, s_md5):
+    ''' blocks stored in an npz cache, None if it belongs to another version of the workbook '''
+    with np.load(s_cache) as npz:
+        if str(npz['__md5__']) != s_md5:
+            return None
+        d_sheet = OrderedDict()
+        for s_key in npz['__columns__']:
+            s_block, s_column = s_key.split('/', 1)
+            d_sheet.setdefault(s_block, OrderedDict())[s_column] = npz[s_key]
+    return d_sheet
+
+
+def _write_cache(s_cache, s_md5, d_sheet):
+    ''' store the blocks as plain arrays, no pickles, keys "block/column" in their original order '''
+    d_arrays = OrderedDict(('%s/%s' % (s_block, s_column), ar) for s_block, d_columns in d_sheet.items()
+                           for s_column, ar in d_columns.items())
+    try:
+        np.savez(s_cache, __md5__=np.array(s_md5, dtype=np.unicode_), __columns__=np.array(list(d_arrays), dtype=np.unicode_), **d_arrays)
+    except (IOError, OSError):
+        pass
+
+
+def toYearFraction(date):
+    ''' convert datetime object, or an array of them, to fractional year '''
+    return daycount.to_year(date)
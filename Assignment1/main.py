@@ -9,10 +9,15 @@ Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
 from curves import OIS, LIBOR
 from swaps import Swap, BasisSwap
 from splines import Spline
+from calibration import Calibration
+from portfolio import SwapPortfolio
+from daycount import year_fraction
+from curvestore import CurveRegistry
 from helper import *
 
 # 3rd party imports
 
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import xlrd
@@ -20,21 +25,29 @@ import scipy.optimize as opt
 import matplotlib.pyplot as plot
 
 
-def main():
+def main(s_optimizer='bfgs', s_registry=None):
+    '''
+    @summary: calibrate the curves to DataSheetCurve, price the par swaps and plot the curves
+    @param s_optimizer: 'bfgs' on the objective, or 'lm' for Levenberg-Marquardt on the residuals
+    @param s_registry: root directory of a curvestore.CurveRegistry to publish the calibrated curves to,
+                       nothing is written if None
+    '''
+    if s_optimizer not in ['bfgs', 'lm']:
+        raise TypeError('The parameter s_optimizer can only be: bfgs, lm')
 
     # read excel rate data
 
     df              = read_DataSheetCurve('ED Futures')
     ED_Future_Rate  = df['Rate']
-    ED_Future_Date  = [0.] + [toYearFraction(curr_date) - toYearFraction(df['IMM date'][0]) for curr_date in df['IMM date'][1:]]
+    ED_Future_Date  = year_fraction(df['IMM date'][0], df['IMM date'])
 
     df              = read_DataSheetCurve('Swap Rates')
     Swap_Rate       = df['Rate']
-    Swap_Date       = [toYearFraction(end_date) - toYearFraction(start_date) for start_date, end_date in zip(df['Start Date'], df['End Date'])]
+    Swap_Date       = year_fraction(df['Start Date'], df['End Date'])
 
     df              = read_DataSheetCurve('Basis Swap Rates')
     Basis_Swap_Rate = df['Basis (bp)'] * 1e-4
-    Basis_Swap_Date = [toYearFraction(end_date) - toYearFraction(start_date) for start_date, end_date in zip(df['Start Date'], df['End Date'])]
+    Basis_Swap_Date = year_fraction(df['Start Date'], df['End Date'])
 
     # generate swap objects, initialization
 
@@ -44,30 +57,37 @@ def main():
     ls_init   = [0.01] * 36
     spline    = Spline(ls_knots)
 
+    # compile the instruments into exposure matrices, once
+
+    penalty = np.zeros((len(ls_knots), len(ls_knots)))
+    penalty[4:10, 4:10] = 0.000001 * spline.splgram(1, 30)[4:10, 4:10]
+    calibration = Calibration(ls_knots, ls_swaps, ls_bswaps, ED_Future_Date, ar_penalty=penalty, spl=spline)
+    calibration.set_quotes(Swap_Rate, Basis_Swap_Rate, ED_Future_Rate)
+
     # optimization
 
     def goal(x):
         """ objective function """
-        oiscoef = x[0:18]
-        liborcoef = x[18:36]
-        ois = OIS(ls_knots,oiscoef)
-        libor = LIBOR(ls_knots,liborcoef)
-        f_ret = sum([(ls_swaps[i].SwapRates(0,ois,libor,spline) - Swap_Rate[i]) ** 2 for i in range(11)]) \
-              + sum([(ls_bswaps[i].SwapRates(0,ois,libor,spline) - Basis_Swap_Rate[i]) ** 2 for i in range(16)]) \
-              + sum([((libor.forwards(ED_Future_Date[i],ED_Future_Date[i]+0.25,spline) - ED_Future_Rate[i]) ** 2) for i in range(8)])
-        penalty = 0.000001 * sum([spline.crossIntegral(k,l,1,30) * (oiscoef[k]*oiscoef[l] + liborcoef[k]*liborcoef[l]) for k in range(4,10) for l in range(4,10)])
-        return f_ret + penalty
+        return calibration.goal(x)
 
     def min_bfgs(ls_init):
-        res = opt.fmin_bfgs(goal, ls_init, gtol = 1e-6, epsilon = 1e-6)
+        res = opt.fmin_bfgs(goal, ls_init, fprime = calibration.gradient, gtol = 1e-6)
         xopt = res
         Qmin = goal(xopt)
         return xopt
 
+    def min_lsq(ls_init):
+        """ Levenberg-Marquardt on the residuals, penalty included as residuals, active coefficients only """
+        return calibration.calibrate(ls_init)
+
     print "Step 1: Optimization, please wait ... "
-    xopt  = min_bfgs(ls_init)
-    ois   = OIS(ls_knots,xopt[0:16])
+    xopt  = min_bfgs(ls_init) if s_optimizer == 'bfgs' else min_lsq(ls_init)
+    ois   = OIS(ls_knots,xopt[0:18])
     libor = LIBOR(ls_knots,xopt[18:36])
+
+    # share the calibrated curves with pricing workers, see curvestore.CurveRegistry.latest
+    if s_registry is not None:
+        CurveRegistry(s_registry).publish('USD', ls_knots, OrderedDict([('OIS', xopt[0:18]), ('LIBOR', xopt[18:36])]), calibration.ar_quotes)
     ls_swapsPlot  = [Swap(0,t,2)    for t in range(1,31)]
     ls_bswapsPlot = [BasisSwap(t,4) for t in range(1,31)]
 
@@ -76,14 +96,25 @@ def main():
     basisSwapParRates = [ls_bswapsPlot[i].SwapRates(0,ois,libor,spline) for i in range(30)]
    
     print "Step 3: Calculating LIBOR ..."
-    liborFwdRates = [libor.forwards(range(0.1,2.,0.1)[i],range(0.1,2.,0.1)[i]+0.25,spline) for i in range(19)]
+    oisSnapshot, liborSnapshot = calibration.snapshots(xopt)
+    liborFwdGrid  = np.arange(1, 20) * 0.1
+    liborFwdRates = liborSnapshot.forward(liborFwdGrid, liborFwdGrid+0.25)
 
     print "Step 4: Calculating Instantaneous rate..."
-    instantLibor = [libor.r(range(0.01,30.,0.01)[i],spline) for i in range(2999)]
-    instantOIS[i] = [ois.r(range(0.01,30.,0.01)[i],spline) for i in range(2999)]
-    instantBasis[i] = [instantLibor[i]-instantOIS[i] for i in range(2999)]
+    instantGrid  = np.arange(1, 3000) * 0.01
+    instantLibor = liborSnapshot.instantaneous(instantGrid)
+    instantOIS   = oisSnapshot.instantaneous(instantGrid)
+    instantBasis = instantLibor - instantOIS
+
+    print "Step 5: Quote risk of the par swaps, without recalibrating ..."
+    # the implicit function theorem needs a first order optimum, BFGS stops short of one at its gtol
+    xrisk     = calibration.calibrate(xopt) if s_optimizer == 'bfgs' else xopt
+    portfolio = SwapPortfolio(np.ones(30), np.arange(1, 31), swapParRates, 2*np.ones(30))
+    dPVs      = portfolio.gradient(OIS(ls_knots,xrisk[0:18]), LIBOR(ls_knots,xrisk[18:36]), spline)[1]
+    quoteRisk = 1e-4 * calibration.quote_risk(xrisk, dPVs)
+    print "PV01 of the 10Y par swap to every quote (swaps, basis swaps, ED futures): \n", quoteRisk[9]
 
-    print "Step 5: Plotting curves"
+    print "Step 6: Plotting curves"
 
     figure1 = plot.figure()
 
@@ -105,15 +136,15 @@ def main():
 
     axis3 = figure1.add_subplot(413) 
     axis3.plot(np.asarray(ED_Future_Date),    100*np.asarray(ED_Future_Rate), 'r-')
-    axis3.plot(np.asarray(range(0.1,2.,0.1)), 100*np.asarray(liborFwdRates), 'b-')
+    axis3.plot(liborFwdGrid, 100*liborFwdRates, 'b-')
     axis3.set_title("LIBOR Rates")
     
     # Instant Rate Curve
 
     axis4 = figure1.add_subplot(414) 
-    axis4.plot(np.asarray(range(0.01,30.,0.01)), 100*np.asarray(instantLibor), 'r-')
-    axis4.plot(np.asarray(range(0.01,30.,0.01)), 100*np.asarray(instantOIS), 'b-')
-    axis4.plot(np.asarray(range(0.01,30.,0.01)), 100*np.asarray(instantBasis), 'y-')
+    axis4.plot(instantGrid, 100*instantLibor, 'r-')
+    axis4.plot(instantGrid, 100*instantOIS, 'b-')
+    axis4.plot(instantGrid, 100*instantBasis, 'y-')
     axis4.set_title("Instantaneous Rates")
 
     plot.show()
@@ -0,0 +1,148 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: Batch pricing of swap portfolios
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# 3rd party imports
+
+import numpy as np
+
+# local imports
+
+from swaps import Swap, BasisSwap
+
+
+class SwapPortfolio(object):
+    '''
+    Portfolio of Swap or BasisSwap trades priced in one pass. Trades sharing maturity and
+    payment frequency share a schedule, the cash-flows of all schedules are reduced to a
+    deduplicated union of payment dates and forward periods, so that pricing is one
+    vectorized curve call per curve followed by scatter-sums back to schedules and trades.
+    '''
+    def __init__(self, ar_notionals, ar_maturities, ar_coupons, ar_payments, b_basis=False, f_time=0.):
+        '''
+        @summary: constructor, builds the schedules and the cash-flow union once
+        @param ar_notionals: notional of every trade
+        @param ar_maturities: maturity of every trade
+        @param ar_coupons: fixed rate of every trade, or basis spread for basis swaps
+        @param ar_payments: payments per year of every trade
+        @param b_basis: whether the trades are basis swaps
+        @param f_time: settlement
+        '''
+        super(SwapPortfolio, self).__init__()
+        self.ar_notionals = np.asarray(ar_notionals, dtype=float)
+        self.ar_coupons   = np.asarray(ar_coupons, dtype=float)
+        self.b_basis      = b_basis
+        self.f_time       = f_time
+
+        # one schedule per distinct (maturity, payments)
+        ar_keys = np.column_stack([np.asarray(ar_maturities, dtype=float), np.asarray(ar_payments, dtype=float)])
+        ar_keys, self.ar_schedule = np.unique(ar_keys, axis=0, return_inverse=True)
+        self.i_schedules = len(ar_keys)
+
+        ls_fixed, ls_float = [], []
+        for i, (f_maturity, f_payments) in enumerate(ar_keys):
+            swap = BasisSwap(f_maturity, f_payments) if b_basis else Swap(1.0, f_maturity, f_payments)
+            ls_fixed.append((i,) + swap.fixed_leg())
+            if not b_basis:
+                ls_float.append((i,) + swap.float_leg())
+        ls_legs = ls_fixed + ls_float
+
+        # deduplicated payment dates and forward periods over every leg
+        ar_ends   = np.concatenate([leg[2] for leg in ls_legs])
+        ar_starts = np.concatenate([leg[1] for leg in ls_legs])
+        self.ar_dates, ar_dateIdx = np.unique(ar_ends, return_inverse=True)
+        ar_periods, ar_periodIdx  = np.unique(np.column_stack([ar_starts, ar_ends]), axis=0, return_inverse=True)
+        self.ar_starts, self.ar_ends = ar_periods[:, 0], ar_periods[:, 1]
+
+        # cash-flows: schedule, discount date, forward period and accrual
+        i_fixed = sum(len(leg[2]) for leg in ls_fixed)
+        ar_sched    = np.concatenate([np.repeat(leg[0], len(leg[2])) for leg in ls_legs])
+        ar_accruals = np.concatenate([leg[3] for leg in ls_legs])
+        self.t_fixed = (ar_sched[:i_fixed], ar_dateIdx[:i_fixed], ar_periodIdx[:i_fixed], ar_accruals[:i_fixed])
+        self.t_float = (ar_sched[i_fixed:], ar_dateIdx[i_fixed:], ar_periodIdx[i_fixed:], ar_accruals[i_fixed:])
+
+
+    def _sum(self, t_leg, ar_values):
+        ''' scatter-sum cash-flow values of a leg into its schedules '''
+        return np.bincount(t_leg[0], weights=ar_values, minlength=self.i_schedules)
+
+
+    def _sum_rows(self, t_leg, ar_rows):
+        ''' scatter-sum cash-flow derivatives of a leg into its schedules '''
+        ar_sums = np.zeros((self.i_schedules, ar_rows.shape[1]))
+        np.add.at(ar_sums, t_leg[0], ar_rows)
+        return ar_sums
+
+
+    def price(self, ois, libor, spl):
+        '''
+        @summary: par rates and PVs of every trade
+        @param ois: OIS object
+        @param libor: LIBOR object
+        @param spl: Spline object
+        @return: (ar_parRates, ar_PVs), as Swap.SwapRates and Swap.PV, or their BasisSwap versions
+        '''
+        ar_disc  = ois.disc_factor(self.f_time, self.ar_dates, spl)
+        ar_libor = libor.forwards(self.ar_starts, self.ar_ends, spl)
+
+        ar_sched, ar_dateIdx, ar_periodIdx, ar_accruals = self.t_fixed
+        ar_P   = ar_disc[ar_dateIdx]
+        ar_L   = ar_libor[ar_periodIdx]
+        ar_ann = self._sum(self.t_fixed, ar_accruals * ar_P)[self.ar_schedule]
+
+        if self.b_basis:
+            # LIBOR minus OIS forwards against the OIS annuity, PV uses F_j = (1/P - 1)/accrual
+            ar_O   = ois.forwards(self.ar_starts, self.ar_ends, spl)[ar_periodIdx]
+            ar_flt = self._sum(self.t_fixed, ar_accruals * (ar_L-ar_O) * ar_P)[self.ar_schedule]
+            ar_pv  = self._sum(self.t_fixed, ar_accruals * ar_P * ar_L - (1.0-ar_P))[self.ar_schedule]
+            return ar_flt / ar_ann, self.ar_notionals * (ar_pv - self.ar_coupons * ar_ann)
+
+        ar_sched, ar_dateIdx, ar_periodIdx, ar_accruals = self.t_float
+        ar_flt = self._sum(self.t_float, ar_accruals * ar_libor[ar_periodIdx] * ar_disc[ar_dateIdx])[self.ar_schedule]
+        return ar_flt / ar_ann, self.ar_notionals * (self.ar_coupons * ar_ann - ar_flt)
+
+
+    def gradient(self, ois, libor, spl):
+        '''
+        @summary: PVs and their derivatives to the curve coefficients, chain rule through Curve.disc_factor
+                  and Curve.forwards: the union of dates and periods is differentiated once, then every
+                  cash-flow row is scatter-summed back to its schedule
+        @param ois: OIS object
+        @param libor: LIBOR object
+        @param spl: Spline object
+        @return: (ar_PVs, ar_dPVs), ar_dPVs of shape (trades, 2*len(ls_coefs)) with the OIS coefficients
+                 followed by the LIBOR ones, as the x of Calibration
+        '''
+        i_coefs   = len(ois.ls_coefs)
+        ar_tenors = self.ar_ends - self.ar_starts
+        ar_disc   = ois.disc_factor(self.f_time, self.ar_dates, spl)
+        ar_growth = np.exp(libor.gamma(self.ar_starts, self.ar_ends, spl))
+        ar_libor  = (ar_growth - 1.0) / ar_tenors
+
+        # d P = -P d gamma on the OIS block, d L = exp(gamma) / tenor d gamma on the LIBOR block
+        ar_dDisc  = np.zeros((len(ar_disc), 2*i_coefs))
+        ar_dLibor = np.zeros((len(ar_libor), 2*i_coefs))
+        ar_dDisc[:, :i_coefs]  = -ar_disc[:, None] * ois.gamma_jacobian(self.f_time, self.ar_dates, spl)
+        ar_dLibor[:, i_coefs:] = (ar_growth/ar_tenors)[:, None] * libor.gamma_jacobian(self.ar_starts, self.ar_ends, spl)
+
+        ar_sched, ar_dateIdx, ar_periodIdx, ar_accruals = self.t_fixed
+        ar_P,  ar_L  = ar_disc[ar_dateIdx],  ar_libor[ar_periodIdx]
+        ar_dP, ar_dL = ar_dDisc[ar_dateIdx], ar_dLibor[ar_periodIdx]
+        ar_ann  = self._sum(self.t_fixed, ar_accruals * ar_P)[self.ar_schedule]
+        ar_dAnn = self._sum_rows(self.t_fixed, ar_accruals[:, None] * ar_dP)[self.ar_schedule]
+
+        if self.b_basis:
+            ar_pv  = self._sum(self.t_fixed, ar_accruals * ar_P * ar_L - (1.0-ar_P))[self.ar_schedule]
+            ar_dPV = self._sum_rows(self.t_fixed, ar_accruals[:, None] * (ar_L[:, None]*ar_dP + ar_P[:, None]*ar_dL) + ar_dP)[self.ar_schedule]
+            return self.ar_notionals * (ar_pv - self.ar_coupons * ar_ann), \
+                   self.ar_notionals[:, None] * (ar_dPV - self.ar_coupons[:, None] * ar_dAnn)
+
+        ar_sched, ar_dateIdx, ar_periodIdx, ar_accruals = self.t_float
+        ar_P,  ar_L  = ar_disc[ar_dateIdx],  ar_libor[ar_periodIdx]
+        ar_dP, ar_dL = ar_dDisc[ar_dateIdx], ar_dLibor[ar_periodIdx]
+        ar_flt  = self._sum(self.t_float, ar_accruals * ar_L * ar_P)[self.ar_schedule]
+        ar_dFlt = self._sum_rows(self.t_float, ar_accruals[:, None] * (ar_L[:, None]*ar_dP + ar_P[:, None]*ar_dL))[self.ar_schedule]
+        return self.ar_notionals * (self.ar_coupons * ar_ann - ar_flt), \
+               self.ar_notionals[:, None] * (self.ar_coupons[:, None] * ar_dAnn - ar_dFlt)
@@ -0,0 +1,65 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: Swap leg payment schedules on integer-month grids
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# 3rd party imports
+
+import numpy as np
+
+# stub rules: where the odd period goes when the tenor is not a multiple of the period
+ls_stubs = ['short_front', 'long_front', 'short_back', 'long_back']
+
+# memo of the generated legs, keyed by (tenor in months, period in months, stub rule)
+d_schedules = {}
+
+
+def to_months(f_tenor):
+    ''' tenor in years to the nearest whole month '''
+    return int(round(f_tenor * 12.0))
+
+
+def leg(f_maturity, f_payments, s_stub='short_front'):
+    '''
+    @summary: accrual periods of a swap leg, memoized by (tenor, frequency)
+    @param f_maturity: maturity in years, snapped to the nearest month, at least one month after snapping
+    @param f_payments: payments per year, a divisor of 12
+    @param s_stub: stub rule, one of ls_stubs, by default dates work back from maturity
+                   and the first period is short
+    @return: (ar_starts, ar_ends, ar_accruals) in years, read-only arrays shared by every caller
+    '''
+    f_period = 12.0 / f_payments
+    if s_stub not in ls_stubs:
+        raise TypeError('The parameter s_stub can only be: ' + ', '.join(ls_stubs))
+    if f_period != int(f_period):
+        raise TypeError('The parameter f_payments must divide 12, got %s' % f_payments)
+    if to_months(f_maturity) < 1:
+        raise TypeError('The parameter f_maturity can only be: at least half a month, got %s' % f_maturity)
+
+    t_key = (to_months(f_maturity), int(f_period), s_stub)
+    if t_key not in d_schedules:
+        d_schedules[t_key] = _leg(*t_key)
+    return d_schedules[t_key]
+
+
+def _leg(i_months, i_period, s_stub):
+    ''' build the integer-month grid of one leg and convert it to years once '''
+    i_full, i_stub = divmod(i_months, i_period)
+    if s_stub.endswith('front'):
+        ls_dates = [0] + [i_stub + i*i_period for i in range(i_full+1)]
+    else:
+        ls_dates = [i*i_period for i in range(i_full+1)] + [i_months]
+    ls_dates = sorted(set(ls_dates))
+
+    # a long stub merges the odd period into its neighbour
+    if i_stub and len(ls_dates) > 2 and s_stub.startswith('long'):
+        del ls_dates[1 if s_stub == 'long_front' else -2]
+
+    ar_months = np.asarray(ls_dates, dtype=int)
+    ar_starts = ar_months[:-1] / 12.0
+    ar_ends   = ar_months[1:] / 12.0
+    ar_accrs  = np.diff(ar_months) / 12.0
+    for ar in (ar_starts, ar_ends, ar_accrs):
+        ar.flags.writeable = False
+    return ar_starts, ar_ends, ar_accrs
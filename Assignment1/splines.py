@@ -7,9 +7,14 @@ Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
 # Python imports
 
 from numpy import *
+import numpy as np
 from scipy.interpolate import splrep, splev, splint
 from matplotlib.pyplot import plot, show
 
+# local imports
+
+from cache import new_cache
+
 def test_splrep():
     """
     Find the B-spline representation of 1-D curve.
@@ -157,18 +162,34 @@ def test_splint():
         
 
 
+def _safe_inverse(ar_width):
+    ''' 1/width for knot differences, 0 for coincident knots '''
+    ar_width = np.asarray(ar_width, dtype=float)
+    return np.where(ar_width > 0., 1. / np.where(ar_width > 0., ar_width, 1.), 0.)
+
+
 class Spline(object):
     ''' B-spline class '''
-    def __init__(self, ls_knots):
+    def __init__(self, ls_knots, i_cacheSize=65536, s_cachePolicy='lru', f_timeQuantum=None):
         '''
         @summary: B-spline constructor
         @param t: type of list, the vector of knots
+        @param i_cacheSize: maximum entries of each cache, None for unbounded
+        @param s_cachePolicy: eviction policy of the caches, 'lru' or 'fifo'
+        @param f_timeQuantum: if given, cached times are rounded to multiples of it
         '''
         super(Spline, self).__init__()
         self.ls_knots       = ls_knots
-        self.d_cache        = {}
-        self.d_cache_gamma  = {}
-        self.d_cache_crsint = {}
+        self.ar_knots       = np.asarray(ls_knots, dtype=float)
+        self.d_cache        = new_cache(s_cachePolicy, i_cacheSize, f_timeQuantum)
+        self.d_cache_crsint = new_cache(s_cachePolicy, i_cacheSize, f_timeQuantum)
+        self.d_ppoly        = {}
+        self.d_banded       = {}
+
+
+    def cache_stats(self):
+        ''' handy function to report hit/miss/eviction counters of every cache '''
+        return {'splrep': self.d_cache.stats(), 'splcrsint': self.d_cache_crsint.stats()}
 
 
     def splrep(self, i_start, i_degree, f_time):
@@ -185,15 +206,176 @@ class Spline(object):
         elif i_degree == 0:
             return 1.
         else:
-            if (i_start, i_degree, f_time) in self.d_cache.keys():
-                return self.d_cache[(i_start, i_degree, f_time)]
-            else:
-                if (i_start, i_degree, f_time) in self.d_cache.keys():
-                    return self.d_cache[(i_start, i_degree, f_time)]
-                else:
-                    self.d_cache[(i_start ,i_degree ,f_time)] = (f_time-f_begin) / (self.ls_knots[i_start+i_degree]-f_begin) * self.splrep(i_start,   i_degree-1, f_time) \
-                                                              + (f_end -f_time)  / (f_end-self.ls_knots[i_start+1])          * self.splrep(i_start+1, i_degree-1, f_time)
-                    return self.d_cache[(i_start ,i_degree ,f_time)]
+            f_value = self.d_cache.get((i_start, i_degree, f_time))
+            if f_value is None:
+                f_value = (f_time-f_begin) / (self.ls_knots[i_start+i_degree]-f_begin) * self.splrep(i_start,   i_degree-1, f_time) \
+                        + (f_end -f_time)  / (f_end-self.ls_knots[i_start+1])          * self.splrep(i_start+1, i_degree-1, f_time)
+                self.d_cache[(i_start, i_degree, f_time)] = f_value
+            return f_value
+
+
+    def splrep_matrix(self, ar_times, i_degree=3):
+        '''
+        @summary: B-spline design matrix, Cox-de Boor over all knot spans at once
+        @param ar_times: array of times
+        @param i_degree: B-spline degree
+        @return: matrix of shape (len(ar_times), len(ls_knots)-i_degree-1), 
+                 entry [n][i] equals splrep(i, i_degree, ar_times[n])
+        '''
+        ar_times = np.atleast_1d(np.asarray(ar_times, dtype=float))[:, None]
+        ar_knots = self.ar_knots
+
+        # degree 0: indicator of the half-open span [t_i, t_{i+1})
+        ar_basis = ((ar_times >= ar_knots[:-1]) & (ar_times < ar_knots[1:])).astype(float)
+
+        # raise the degree one step at a time, every basis function at once
+        for i_d in range(1, i_degree+1):
+            ar_begin = ar_knots[:-i_d-1]
+            ar_end   = ar_knots[i_d+1:]
+            ar_left  = _safe_inverse(ar_knots[i_d:-1] - ar_begin)
+            ar_right = _safe_inverse(ar_end - ar_knots[1:-i_d])
+            ar_basis = (ar_times-ar_begin) * ar_left  * ar_basis[:, :-1] \
+                     + (ar_end-ar_times)   * ar_right * ar_basis[:, 1:]
+        return ar_basis
+
+
+    def splppoly(self, i_degree=3):
+        '''
+        @summary: piecewise-polynomial form of every basis function, built once per degree
+        @param i_degree: B-spline degree
+        @return: (ar_poly, ar_int), both indexed [span][basis][power] in the local 
+                 variable (t - t_span); ar_poly holds the basis functions, ar_int their 
+                 antiderivatives \int_{-inf}^t including the constant from earlier spans
+        '''
+        if i_degree not in self.d_ppoly:
+            ar_knots = self.ar_knots
+            ar_span  = ar_knots[:-1, None, None]
+            i_spans  = len(ar_knots) - 1
+
+            # degree 0: basis i equals 1 on span i only
+            ar_poly = np.eye(i_spans)[:, :, None]
+
+            # Cox-de Boor on the coefficients, (t - t_i) = x + (t_span - t_i) on each span
+            for i_d in range(1, i_degree+1):
+                ar_begin = ar_knots[None, :-i_d-1, None]
+                ar_end   = ar_knots[None, i_d+1:, None]
+                ar_left  = _safe_inverse(ar_knots[i_d:-1] - ar_knots[:-i_d-1])[None, :, None]
+                ar_right = _safe_inverse(ar_knots[i_d+1:] - ar_knots[1:-i_d])[None, :, None]
+                ar_lo    = ar_left  * ar_poly[:, :-1, :]
+                ar_hi    = ar_right * ar_poly[:, 1:, :]
+                ar_next  = np.zeros((i_spans, ar_lo.shape[1], i_d+1))
+                ar_next[:, :, :-1] += (ar_span-ar_begin) * ar_lo + (ar_end-ar_span) * ar_hi
+                ar_next[:, :, 1:]  += ar_lo - ar_hi
+                ar_poly = ar_next
+
+            # antiderivative, constants accumulate the full integral over earlier spans
+            ar_int = np.zeros((i_spans, ar_poly.shape[1], i_degree+2))
+            ar_int[:, :, 1:] = ar_poly / np.arange(1., i_degree+2)
+            ar_width = np.diff(ar_knots)[:, None, None] ** np.arange(1, i_degree+2)
+            ar_full  = (ar_int[:, :, 1:] * ar_width).sum(axis=2)
+            ar_int[1:, :, 0] = np.cumsum(ar_full, axis=0)[:-1]
+            self.d_ppoly[i_degree] = (ar_poly, ar_int)
+        return self.d_ppoly[i_degree]
+
+
+    def splspan(self, ar_times, i_degree=3):
+        '''
+        @summary: knot span of every time by binary search, clipped to the first and last spans
+        @param ar_times: array of times
+        @param i_degree: B-spline degree
+        @return: (ar_times, ar_spans, ar_first), ar_first = ar_spans - i_degree is the index of the
+                 first basis function not zero on the span, negative near the first knot
+        '''
+        ar_times = np.atleast_1d(np.asarray(ar_times, dtype=float))
+        ar_spans = np.clip(np.searchsorted(self.ar_knots, ar_times, side='right') - 1, 0, len(self.ar_knots)-2)
+        return ar_times, ar_spans, ar_spans - i_degree
+
+
+    def splbanded(self, i_degree=3):
+        '''
+        @summary: splppoly restricted to the basis functions active on each span, built once per degree
+        @param i_degree: B-spline degree
+        @return: (ar_poly, ar_int), both indexed [span][k][power] for the basis function span-i_degree+k,
+                 zero when that index is out of range
+        '''
+        if i_degree not in self.d_banded:
+            ar_spans = np.arange(len(self.ar_knots)-1)[:, None]
+            ar_index = ar_spans + np.arange(i_degree+1)
+            ls_tables = []
+            for ar_table in self.splppoly(i_degree):
+                ar_pad = np.zeros((ar_table.shape[0], i_degree, ar_table.shape[2]))
+                ar_table = np.concatenate([ar_pad, ar_table, ar_pad], axis=1)
+                ls_tables.append(ar_table[ar_spans, ar_index])
+            self.d_banded[i_degree] = tuple(ls_tables)
+        return self.d_banded[i_degree]
+
+
+    def _splhorner(self, ar_times, i_degree, i_table):
+        ''' Horner on the active rows of a splbanded table, in the local variable of the span of every time '''
+        ar_times, ar_spans, ar_first = self.splspan(ar_times, i_degree)
+        ar_coefs = self.splbanded(i_degree)[i_table][ar_spans]
+        ar_x     = (ar_times - self.ar_knots[ar_spans])[:, None]
+        ar_sum   = ar_coefs[:, :, -1]
+        for i_k in range(ar_coefs.shape[2]-2, -1, -1):
+            ar_sum = ar_sum * ar_x + ar_coefs[:, :, i_k]
+        return ar_times, ar_first, ar_sum
+
+
+    def splactive(self, ar_times, i_degree=3):
+        '''
+        @summary: the i_degree+1 basis functions not zero at every time, from the polynomial pieces
+                  of its knot span only
+        @param ar_times: array of times
+        @param i_degree: B-spline degree
+        @return: (ar_first, ar_values), ar_values of shape (len(ar_times), i_degree+1) with entry [n][k]
+                 equal to splrep(ar_first[n]+k, i_degree, ar_times[n]), zero for indices out of range
+        '''
+        ar_times, ar_first, ar_values = self._splhorner(ar_times, i_degree, 0)
+        ar_values[(ar_times < self.ar_knots[0]) | (ar_times >= self.ar_knots[-1])] = 0.
+        return ar_first, ar_values
+
+
+    def splint_active(self, ar_times, i_degree=3):
+        '''
+        @summary: \int_{-inf}^t of the i_degree+1 basis functions not zero on the span of every time,
+                  the ones left of it are fully passed and integrate to (t_{i+k+1}-t_i)/(k+1)
+        @param ar_times: array of times
+        @param i_degree: B-spline degree
+        @return: (ar_first, ar_ints) as splactive, past the last knot ar_first is the number of
+                 basis functions and ar_ints is zero
+        '''
+        ar_times, ar_first, ar_ints = self._splhorner(ar_times, i_degree, 1)
+        ar_out = (ar_times < self.ar_knots[0]) | (ar_times >= self.ar_knots[-1])
+        ar_ints[ar_out] = 0.
+        ar_first[ar_times >= self.ar_knots[-1]] = len(self.ar_knots) - i_degree - 1
+        return ar_first, ar_ints
+
+
+    def splint_matrix(self, ar_times, i_degree=3):
+        '''
+        @summary: B-spline integration \int_{-inf}^t of every basis function at once
+        @param ar_times: array of times
+        @param i_degree: B-spline degree
+        @return: matrix of shape (len(ar_times), len(ls_knots)-i_degree-1), 
+                 entry [n][i] equals splint(i, i_degree, ar_times[n])
+        '''
+        ar_times = np.atleast_1d(np.asarray(ar_times, dtype=float))
+        ar_knots = self.ar_knots
+        ar_int   = self.splppoly(i_degree)[1]
+
+        # locate the knot span, then Horner in the local variable
+        ar_spans = np.clip(np.searchsorted(ar_knots, ar_times, side='right') - 1, 0, len(ar_knots)-2)
+        ar_x     = (ar_times - ar_knots[ar_spans])[:, None]
+        ar_coefs = ar_int[ar_spans]
+        ar_sum   = ar_coefs[:, :, -1]
+        for i_k in range(i_degree, -1, -1):
+            ar_sum = ar_sum * ar_x + ar_coefs[:, :, i_k]
+
+        # outside the knots: nothing yet, or the whole area (t_{i+k+1}-t_i)/(k+1)
+        ar_total = (ar_knots[i_degree+1:] - ar_knots[:-i_degree-1]) / (i_degree+1)
+        ar_sum[ar_times < ar_knots[0]] = 0.
+        ar_sum[ar_times >= ar_knots[-1]] = ar_total
+        return ar_sum
 
 
     def splint(self, i_start, i_degree, f_time):
@@ -203,18 +385,30 @@ class Spline(object):
         @param i_degree: B-spline degree
         @param f_time: time 
         '''
-        f_begin = self.ls_knots[i_start]
-        f_end   = self.ls_knots[i_start+i_degree+1]
-        if f_time < f_begin:
-            return 0.
-        elif f_time >= f_end:
-            return (f_end-f_begin) / (i_degree+1)
-        else:
-            f_sum = 0.
-            while self.ls_knots[i_start] < f_time:
-                f_sum += (f_end - f_begin) / (i_degree + 1) * self.splrep(i_start, i_degree + 1, f_time)
-                i_start += 1
-            return f_sum
+        return self.splint_matrix([f_time], i_degree)[0, i_start]
+
+
+    def splder_matrix(self, ar_times, i_degree=3, i_order=1):
+        '''
+        @summary: derivative design matrix, the Cox-de Boor pass stops at degree i_degree-i_order and the
+                  derivatives come from the knot differences
+                  d/dt B_{i,k} = k B_{i,k-1} / (t_{i+k}-t_i) - k B_{i+1,k-1} / (t_{i+k+1}-t_{i+1})
+        @param ar_times: array of times
+        @param i_degree: B-spline degree
+        @param i_order: order of the derivative, 0 for splrep_matrix
+        @return: matrix of shape (len(ar_times), len(ls_knots)-i_degree-1),
+                 entry [n][i] equals splder(i, i_degree, ar_times[n], i_order)
+        '''
+        ar_knots = self.ar_knots
+        if i_order > i_degree:
+            return np.zeros((np.size(ar_times), len(ar_knots)-i_degree-1))
+
+        ar_basis = self.splrep_matrix(ar_times, i_degree-i_order)
+        for i_d in range(i_degree-i_order+1, i_degree+1):
+            ar_left  = _safe_inverse(ar_knots[i_d:-1] - ar_knots[:-i_d-1])
+            ar_right = _safe_inverse(ar_knots[i_d+1:] - ar_knots[1:-i_d])
+            ar_basis = i_d * (ar_left * ar_basis[:, :-1] - ar_right * ar_basis[:, 1:])
+        return ar_basis
 
 
     def splder(self, i_start, i_degree, f_time, order):
@@ -225,37 +419,62 @@ class Spline(object):
         @param f_time: time 
         @param i_order: highest order
         '''
-        f_begin = self.ls_knots[i_start]
-        f_end   = self.ls_knots[i_start+i_degree+1]
-        if order == 0:
-            return self.splrep(i_start, i_degree, f_time)
-        elif order == 1 and i_degree < 1.:
-                return 0.
-        else:
-            return i_degree / ( self.ls_knots[i_start+i_degree]-f_begin) * self.splder(i_start,   i_degree-1, f_time, order-1) \
-                 + i_degree / (-self.ls_knots[i_start+1]       +f_end  ) * self.splder(i_start+1, i_degree-1, f_time, order-1)
+        return self.splder_matrix([f_time], i_degree, order)[0, i_start]
 
 
     def splgamma(self, i_start, f_start, f_end):
         ''' B-spline gamma '''
-        if (i_start, f_start, f_end) in self.d_cache_gamma.keys():
-            pass
-        else:
-            self.d_cache_gamma[(i_start, f_start, f_end)] = self.splint(i_start,3,f_end) - self.splint(i_start,3,f_start)
-        return self.d_cache_gamma[(i_start, f_start, f_end)]
+        return self.splgamma_matrix(f_start, f_end)[0, i_start]
+
+
+    def splgamma_matrix(self, ar_start, ar_end):
+        '''
+        @summary: B-spline gamma \int_a^b of every cubic basis function at once
+        @param ar_start: array of start times a
+        @param ar_end: array of end times b, broadcast against ar_start
+        @return: matrix of shape (n, len(ls_knots)-4)
+        '''
+        ar_start, ar_end = np.broadcast_arrays(np.atleast_1d(np.asarray(ar_start, dtype=float)),
+                                               np.atleast_1d(np.asarray(ar_end,   dtype=float)))
+        return self.splint_matrix(ar_end, 3) - self.splint_matrix(ar_start, 3)
+
+
+    def splgram(self, f_start, f_end, i_order=2, i_degree=3):
+        '''
+        @summary: Gram matrix \int_a^b B^{(m)}_k B^{(m)}_l dt of every pair of basis functions, in closed form
+                  from their polynomial pieces, memoized per interval and order
+        @param f_start: start of the interval a
+        @param f_end: end of the interval b
+        @param i_order: order m of the derivatives, 2 for the roughness penalty
+        @param i_degree: B-spline degree
+        @return: symmetric read-only matrix of shape (len(ls_knots)-i_degree-1, len(ls_knots)-i_degree-1)
+        '''
+        t_key = (float(f_start), float(f_end), i_order, i_degree)
+        ar_gram = self.d_cache_crsint.get(t_key)
+        if ar_gram is None:
+            ar_knots = self.ar_knots
+            ar_poly  = self.splppoly(i_degree)[0]
+
+            # m-th derivative of every piece, powers p >= m become p!/(p-m)! x^(p-m)
+            ar_pows  = np.arange(i_order, i_degree+1)
+            ar_scale = np.array([np.prod(np.arange(p-i_order+1, p+1)) for p in ar_pows], dtype=float)
+            ar_der   = ar_poly[:, :, i_order:] * ar_scale
+
+            # \int of x^(p+q) over the part of every span inside [a, b], in the local variable
+            ar_lo = np.clip(f_start, ar_knots[:-1], ar_knots[1:]) - ar_knots[:-1]
+            ar_hi = np.clip(f_end,   ar_knots[:-1], ar_knots[1:]) - ar_knots[:-1]
+            ar_n  = np.add.outer(np.arange(ar_der.shape[2]), np.arange(ar_der.shape[2])) + 1.
+            ar_w  = (ar_hi[:, None, None]**ar_n - ar_lo[:, None, None]**ar_n) / ar_n
+
+            ar_gram = np.einsum('skp,slq,spq->kl', ar_der, ar_der, ar_w)
+            ar_gram.flags.writeable = False
+            self.d_cache_crsint[t_key] = ar_gram
+        return ar_gram
 
 
     def splcrsint(self, i_start, i_start2, f_start, f_end):
         ''' B-spline cross integration, as of \int_a^b B^{''}_k*B^{''}_l dt '''
-        if (i_start, i_start2, f_start, f_end) in self.d_cache_crsint.keys():
-            pass
-        else:
-            f_term1 = self.splder(i_start, 3, f_end  , 1) * self.splder(i_start2, 3, f_end,   2)
-            f_term2 = self.splder(i_start, 3, f_start, 1) * self.splder(i_start2, 3, f_start, 2)
-            ls_windows = [f_start] + [f_time for t_time in self.ls_knots if f_start < f_time < f_end] + [f_end]
-            f_term3 = sum(self.splder(f_start2, 3, ls_windows[j-1], 3) * (self.splrep(i_start, 3, ls_windows[j])- self.splrep(i_start, 3, ls_windows[j-1])) for j in range(1, len(ls_windows)+2))
-            self.d_cache_crsint[(i_start, i_start2, f_start, f_end)] = f_term1 - f_term2 - f_term3
-        return self.d_cache_crsint[(i_start, i_start2, f_start, f_end)]
+        return self.splgram(f_start, f_end)[i_start, i_start2]
 
 
 def main():
@@ -4,6 +4,14 @@ Description: Swap rates
 Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
 """
 
+# 3rd party imports
+
+import numpy as np
+
+# local imports
+
+import schedule
+
 class Swap(object):
     ''' Swap object '''
     def __init__(self, f_notional, f_maturity, f_payments):
@@ -19,6 +27,22 @@ class Swap(object):
         self.f_payments = f_payments 
 
 
+    def fixed_leg(self):
+        """
+        @summary: fixed leg schedule, f_payments per year worked back from maturity
+        @return: (ar_starts, ar_ends, ar_accruals) of the accrual periods, shared read-only arrays
+        """
+        return schedule.leg(self.f_maturity, self.f_payments)
+
+
+    def float_leg(self):
+        """
+        @summary: floating leg schedule, quarterly payment dates worked back from maturity
+        @return: (ar_starts, ar_ends, ar_accruals) of the accrual periods, shared read-only arrays
+        """
+        return schedule.leg(self.f_maturity, 4) #quarterly in US
+
+
     def SwapRates(self, f_time, ois, libor, spl):
         """ 
         @summary: calculate par swap rate, S_0(T_0,T), 
@@ -28,18 +52,12 @@ class Swap(object):
         @param spl: Spline object
         """
         # fixed leg
-        f_AV       = 0.
-        f_maturity = self.f_maturity
-        while f_maturity > 0:
-            f_AV       += 1.0 / self.f_maturity * ois.disc_factor(f_time, f_maturity, spl)
-            f_maturity -= 1.0 / self.f_maturity
+        ar_starts, ar_ends, ar_accruals = self.fixed_leg()
+        f_AV = np.sum(ar_accruals * ois.disc_factor(f_time, ar_ends, spl))
 
         # floating leg
-        f_PV = 0 
-        f_maturity = self.f_maturity #Work payment dates back from maturity
-        while f_maturity > 0:
-            f_PV += 0.25 * libor.forwards(f_maturity-0.25,f_maturity,spl)*ois.disc_factor(f_time,f_maturity,spl)
-            f_maturity -= .25 #quarterly in US
+        ar_starts, ar_ends, ar_accruals = self.float_leg()
+        f_PV = np.sum(ar_accruals * libor.forwards(ar_starts, ar_ends, spl) * ois.disc_factor(f_time, ar_ends, spl))
 
         return f_PV / f_AV
 
@@ -54,19 +72,13 @@ class Swap(object):
         @param f_coupon: coupon rate
         """
         # PV of fixed leg
-        f_AV = 0  
-        f_maturity = self.f_maturity
-        while f_maturity > 0:
-            f_AV       += 1.0 / self.f_maturity * ois.disc_factor(f_time, f_maturity, spl)
-            f_maturity -= 1.0 / self.f_maturity
+        ar_starts, ar_ends, ar_accruals = self.fixed_leg()
+        f_AV  = np.sum(ar_accruals * ois.disc_factor(f_time, ar_ends, spl))
         f_AV *= f_coupon 
 
         # PV of floating leg 
-        f_PV = 0.
-        f_maturity = self.f_maturity 
-        while f_maturity > 0:
-            f_PV += .25 *libor.forwards(f_maturity-0.25,f_maturity,spl)*ois.disc_factor(f_time,f_maturity,spl)
-            f_maturity -= .25 
+        ar_starts, ar_ends, ar_accruals = self.float_leg()
+        f_PV = np.sum(ar_accruals * libor.forwards(ar_starts, ar_ends, spl) * ois.disc_factor(f_time, ar_ends, spl))
 
         return self.f_notional * (f_AV - f_PV)
 
@@ -91,17 +103,11 @@ class BasisSwap(Swap):
         @param spl: Spline object
         """
 
-        f_AV = 0.
-        f_maturity = self.f_maturity
-        while f_maturity > 0:
-            f_AV += 1.0 / self.f_maturity *(libor.forwards(f_maturity - 1.0/self.f_maturity, f_maturity, spl)-ois.forwards(f_maturity - 1.0/self.f_maturity, f_maturity,spl))*ois.disc_factor(f_time, f_maturity, spl)
-            f_maturity -= 1.0/self.f_maturity
-        
-        f_PV = 0.
-        f_maturity = self.f_maturity
-        while f_maturity > 0:
-            f_PV += 1.0 / self.f_maturity * ois.disc_factor(f_time, f_maturity, spl)
-            f_maturity -= 1.0 / self.f_maturity
+        ar_starts, ar_ends, ar_accruals = self.fixed_leg()
+        ar_disc = ois.disc_factor(f_time, ar_ends, spl)
+
+        f_AV = np.sum(ar_accruals * (libor.forwards(ar_starts, ar_ends, spl)-ois.forwards(ar_starts, ar_ends, spl)) * ar_disc)
+        f_PV = np.sum(ar_accruals * ar_disc)
         
         return f_AV / f_PV 
 
@@ -114,12 +120,9 @@ class BasisSwap(Swap):
         @param spl: Spline object
         @param f_basis: basis point
         """
-        f_PV = 0
-        f_maturity = self.f_maturity
-        while f_maturity > 0: 
-            P_0 = ois.disc_factor(f_time, f_maturity, spl)
-            L_j = libor.forwards(f_maturity - 1.0/self.f_maturity, f_maturity, spl)
-            F_j = ((1./ P_0)-1.) / (1.0/ self.f_maturity)
-            f_PV += (1.0/self.f_maturity)*P_0*(L_j-F_j-f_basis) 
-            f_maturity -= 1.0/self.f_maturity
+        ar_starts, ar_ends, ar_accruals = self.fixed_leg()
+        P_0  = ois.disc_factor(f_time, ar_ends, spl)
+        L_j  = libor.forwards(ar_starts, ar_ends, spl)
+        F_j  = ((1./ P_0)-1.) / ar_accruals
+        f_PV = np.sum(ar_accruals*P_0*(L_j-F_j-f_basis))
         return f_notional * f_PV
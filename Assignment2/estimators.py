@@ -0,0 +1,54 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: Streaming Monte Carlo estimators
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# 3rd party imports
+import numpy as np
+
+
+class RunningMoments(object):
+    '''
+    Running mean and co-moment matrix of vector samples, Welford's update merged a batch
+    at a time (Chan et al.), so that samples never need to be kept around.
+    '''
+
+    def __init__(self, i_dims):
+        '''
+        @summary: constructor
+        @param i_dims: size of one sample
+        '''
+        super(RunningMoments, self).__init__()
+        self.i_count     = 0
+        self.ar_mean     = np.zeros(i_dims)
+        self.ar_comoment = np.zeros((i_dims, i_dims))
+
+    def update(self, ar_samples):
+        '''
+        @summary: add a batch of samples
+        @param ar_samples: array of shape (samples, i_dims)
+        '''
+        ar_samples = np.asarray(ar_samples, dtype=float)
+        if not len(ar_samples):
+            return
+        ar_mean = ar_samples.mean(axis=0)
+        ar_dev  = ar_samples - ar_mean
+        self.merge(len(ar_samples), ar_mean, ar_dev.T.dot(ar_dev))
+
+    def merge(self, i_count, ar_mean, ar_comoment):
+        '''
+        @summary: add the moments of another set of samples
+        @param i_count: number of samples
+        @param ar_mean: their mean
+        @param ar_comoment: sum of the outer products of their deviations from ar_mean
+        '''
+        i_total  = self.i_count + i_count
+        ar_delta = ar_mean - self.ar_mean
+        self.ar_mean     = self.ar_mean + ar_delta * float(i_count) / i_total
+        self.ar_comoment = self.ar_comoment + ar_comoment + np.outer(ar_delta, ar_delta) * float(self.i_count) * i_count / i_total
+        self.i_count     = i_total
+
+    def covariance(self):
+        ''' handy function to return the sample covariance matrix '''
+        return self.ar_comoment / max(self.i_count-1, 1)
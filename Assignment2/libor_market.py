@@ -11,15 +11,33 @@ import math
 import numpy as np
 
 
+def pca_loadings(ar_corr, i_factors):
+    '''
+    @summary: factor loadings of a correlation matrix reduced to its leading principal components
+    @param ar_corr: correlation matrix of the forwards
+    @param i_factors: number of factors kept
+    @return: array B of shape (forwards, i_factors), rows rescaled to unit norm so that B B' has a unit diagonal
+    '''
+    ar_eigval, ar_eigvec = np.linalg.eigh(np.asarray(ar_corr, dtype=float))
+    ar_order = np.argsort(ar_eigval)[::-1][:i_factors]
+    ar_B     = ar_eigvec[:, ar_order] * np.sqrt(np.clip(ar_eigval[ar_order], 0., None))
+    ar_norm  = np.sqrt(np.sum(ar_B*ar_B, axis=1))
+    return ar_B / np.where(ar_norm > 0, ar_norm, 1.0)[:, None]
+
+
 class Libor_Market(object):
-    ''' Class Libor_Market to do Monte Carlo, 1 Brownian Motion '''
+    ''' Class Libor_Market to do Monte Carlo, 1 Brownian Motion, or i_factors in simulate_paths '''
 
-    def __init__(self, ls_init, i_N, b_frozenCurve=False):
+    def __init__(self, ls_init, i_N, b_frozenCurve=False, ar_corr=None, i_factors=1, ar_vols=None):
         '''
         @summary: constructor to do initialization
         @param ls_init: list of init value 
         @param i_N: size of matrix column
         @param b_frozenCurve: whether to use frozen curve
+        @param ar_corr: correlation matrix of the forwards ls_init, perfectly correlated if None
+        @param i_factors: number of Brownian motions, the leading principal components of ar_corr
+        @param ar_vols: piecewise constant volatilities, of shape (i_M,) per forward or (i_N-1, i_M)
+                        per time step and forward, flat f_sigma if None
         '''
         super(Libor_Market, self).__init__()
 
@@ -30,6 +48,19 @@ class Libor_Market(object):
         self.ls_init = ls_init
         self.b_frozenCurve = b_frozenCurve
         self.ls = np.zeros((self.i_M, self.i_N))
+
+        # multi-factor volatility structure used by simulate_paths
+        if i_factors < 1 or i_factors > self.i_M:
+            raise TypeError('The parameter i_factors can only be: 1 to %d' % self.i_M)
+        self.i_factors   = i_factors
+        self.ar_corr     = np.ones((self.i_M, self.i_M)) if ar_corr is None else np.asarray(ar_corr, dtype=float)
+        if self.ar_corr.shape != (self.i_M, self.i_M):
+            raise TypeError('The parameter ar_corr can only be: a matrix of shape (%d, %d)' % (self.i_M, self.i_M))
+        self.ar_loadings = pca_loadings(self.ar_corr, i_factors)
+        t_vols = (max(self.i_N-1, 0), self.i_M)
+        if ar_vols is not None and np.shape(ar_vols) not in [t_vols[1:], t_vols]:
+            raise TypeError('The parameter ar_vols can only be: an array of shape (%d,) or (%d, %d)' % ((t_vols[1],) + t_vols))
+        self.ar_vols     = np.broadcast_to(self.f_sigma if ar_vols is None else np.asarray(ar_vols, dtype=float), t_vols)
         
     def simulate(self):
         ''' 
@@ -48,7 +79,135 @@ class Libor_Market(object):
                 if j < (self.i_M-i):
                     f_currLiborRate = self.delta(i,j) * self.f_t + self.f_sigma * d_brownianMotion
                     self.ls[i][j] = max(self.ls[i-1][j+1] + f_currLiborRate,0.0)
+
+    def simulate_paths(self, i_paths, ar_normals=None, rng=None, f_row=None, i_rows=None, b_packed=False):
+        ''' 
+        @summary: simulate many paths at once, every step evolves all paths together
+        @param i_paths: number of paths
+        @param ar_normals: standard normals of shape (i_paths, i_N-1), (i_paths, i_N-1, i_factors)
+                           with several factors, drawn from rng if None
+        @param rng: random stream with a standard_normal method, np.random if None
+        @param f_row: if given, called as f_row(i, ar_row) with the live forwards of row i of every path,
+                      shape (i_paths, live forwards), as soon as the row is simulated; nothing is stored
+                      but the previous row, and the call returns None
+        @param i_rows: number of rows to simulate, i_N if None, the others are left at zero
+        @param b_packed: store only the live forwards of every row, back to back, see row_offsets
+        @return: array of shape (i_paths, i_N, i_M), entry [p][i][j] as self.ls[i][j] of path p,
+                 or (i_paths, row_offsets()[-1]) if b_packed, or None if f_row is given
+        '''
+        i_rows  = self.i_N if i_rows is None else min(i_rows, self.i_N)
+        ar_init = np.asarray(self.ls_init, dtype=float)
+        if f_row is None and b_packed:
+            ar_offsets = self.row_offsets()
+            ar_ls = np.zeros((i_paths, ar_offsets[-1]))
+            def f_row(i, ar_row):
+                ar_ls[:, ar_offsets[i]:ar_offsets[i+1]] = ar_row
+        elif f_row is None:
+            ar_ls = np.zeros((i_paths, self.i_N, self.i_M))
+            def f_row(i, ar_row):
+                ar_ls[:, i, :ar_row.shape[1]] = ar_row
+        else:
+            ar_ls = None
+
+        ar_prev = np.tile(ar_init, (i_paths, 1))
+        f_row(0, ar_prev)
+        if ar_normals is None:
+            ar_normals = self.normals(i_paths, rng)
+        ar_dW   = math.sqrt(self.f_t) * np.asarray(ar_normals, dtype=float).reshape(i_paths, -1, self.i_factors)
+        f_drift = -self.f_t * self.f_t
+
+        # simulate, forward j of row i is forward i+j of ls_init, with loadings lambda = vol * B
+        for i in range(1, i_rows):
+            i_alive = self.i_M - i
+            if i_alive <= 0:
+                break
+            ar_lambda = self.ar_vols[i-1, i:i+i_alive, None] * self.ar_loadings[i:i+i_alive]
+            ar_shift  = ar_prev[:, 1:i_alive+1]
+            ar_shock  = ar_dW[:, i-1].dot(ar_lambda.T)
+            if self.b_frozenCurve:
+                # drift lambda_j . sum over n > j of lambda_n / (1 + t L_n) on the initial curve, a reverse cumulative sum
+                ar_inv = ar_lambda / (1.0 + self.f_t*ar_init[i:i+i_alive])[:, None]
+                ar_sum = np.concatenate([np.cumsum(ar_inv[:0:-1], axis=0)[::-1], np.zeros((1, self.i_factors))])
+                ar_row = np.maximum(ar_shift + f_drift*np.sum(ar_lambda*ar_sum, axis=1) + ar_shock, 0.0)
+            else:
+                # same sum on the current row, running from the last forward down, O(i_factors) per forward
+                ar_row = np.empty((i_paths, i_alive))
+                ar_sum = np.zeros((i_paths, self.i_factors))
+                for j in range(i_alive-1, -1, -1):
+                    ar_row[:, j] = np.maximum(ar_shift[:, j] + f_drift*ar_sum.dot(ar_lambda[j]) + ar_shock[:, j], 0.0)
+                    ar_sum += ar_lambda[j] / (1.0 + self.f_t*ar_row[:, j:j+1])
+            f_row(i, ar_row)
+            ar_prev = ar_row
+        return ar_ls
+
+    def adjoint(self, ls_rows, ls_bars):
+        '''
+        @summary: pathwise gradient to ls_init of a payoff of the first rows, by a reverse sweep over the
+                  rows simulate_paths passed to f_row, each step costs as much as a step of simulate_paths
+        @param ls_rows: rows 0, ..., R-1 of the paths, shape (paths, live forwards) each
+        @param ls_bars: derivatives of the payoff of every path to these rows, same shapes
+        @return: array of shape (paths, i_M), derivatives of the payoff of every path to ls_init
+        '''
+        ar_init = np.asarray(self.ls_init, dtype=float)
+        f_drift = -self.f_t * self.f_t
+        ar_barInit = np.zeros_like(ls_bars[0])
+        ar_bar     = np.array(ls_bars[-1], dtype=float)
+        for i in range(len(ls_rows)-1, 0, -1):
+            ar_row    = ls_rows[i]
+            i_alive   = ar_row.shape[1]
+            ar_lambda = self.ar_vols[i-1, i:i+i_alive, None] * self.ar_loadings[i:i+i_alive]
+            ar_barPrev = np.array(ls_bars[i-1], dtype=float)
+            if self.b_frozenCurve:
+                # the drift of forward j reads ls_init[i+n] for n > j, exclusive cumulative sums over j
+                ar_pre = ar_bar * (ar_row > 0)
+                ar_barPrev[:, 1:i_alive+1] += ar_pre
+                ar_cum = np.cumsum(ar_pre[:, :, None] * ar_lambda, axis=1)[:, :-1]
+                ar_inv = -self.f_t / (1.0 + self.f_t*ar_init[i+1:i+i_alive])**2
+                ar_barInit[:, i+1:i+i_alive] += f_drift * np.sum(ar_cum*ar_lambda[1:], axis=2) * ar_inv
+            else:
+                # the drift of forward j reads forwards n > j of the same row, undo from the first forward up
+                ar_cum = np.zeros((len(ar_row), self.i_factors))
+                for j in range(i_alive):
+                    ar_bar[:, j] -= ar_cum.dot(ar_lambda[j]) * self.f_t / (1.0 + self.f_t*ar_row[:, j])**2
+                    ar_pre = ar_bar[:, j] * (ar_row[:, j] > 0)
+                    ar_barPrev[:, j+1] += ar_pre
+                    ar_cum += f_drift * ar_pre[:, None] * ar_lambda[j]
+            ar_bar = ar_barPrev
+        return ar_barInit + ar_bar
+
+    def row_offsets(self):
+        '''
+        @summary: layout of the packed paths, row i has i_M - i live forwards (i_M for the initial row)
+        @return: array of i_N+1 offsets, row i of a packed path is [offsets[i]:offsets[i+1]]
+        '''
+        ar_alive = np.maximum(self.i_M - np.arange(self.i_N), 0)
+        ar_alive[0] = self.i_M
+        return np.concatenate([[0], np.cumsum(ar_alive)])
+
+    def packed_row(self, ar_packed, i):
+        ''' handy function to return row i of packed paths '''
+        ar_offsets = self.row_offsets()
+        return ar_packed[:, ar_offsets[i]:ar_offsets[i+1]]
     
+    def normals(self, i_paths, rng=None, b_antithetic=False):
+        '''
+        @summary: standard normals driving simulate_paths
+        @param i_paths: number of paths
+        @param rng: random stream with a standard_normal method, np.random if None,
+                    or a qmc.SobolStream for bridged quasi random normals
+        @param b_antithetic: whether consecutive paths come in antithetic pairs (Z, -Z)
+        @return: array of shape (i_paths, i_N-1), or (i_paths, i_N-1, i_factors) with several factors
+        '''
+        rng = np.random if rng is None else rng
+        t_shape = (self.i_N-1,) if self.i_factors == 1 else (self.i_N-1, self.i_factors)
+        if not b_antithetic:
+            return rng.standard_normal((i_paths,) + t_shape)
+        ar_half    = rng.standard_normal(((i_paths+1)//2,) + t_shape)
+        ar_normals = np.empty((2*len(ar_half),) + t_shape)
+        ar_normals[0::2] = ar_half
+        ar_normals[1::2] = -ar_half
+        return ar_normals[:i_paths]
+
     def delta(self, i, j):
         '''
         @summary: calculate delta by using terminal forward measure
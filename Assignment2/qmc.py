@@ -0,0 +1,182 @@
+"""
+Copyright: Copyright (C) 2015 Baruch College - Interest Rate Model
+Description: Quasi Monte Carlo, scrambled Sobol sequences and Brownian bridge
+Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
+"""
+
+# 3rd party imports
+import numpy as np
+from scipy.special import ndtri
+
+
+I_BITS = 32
+
+
+def primitive_polynomials(i_count):
+    '''
+    @summary: first primitive polynomials over GF(2), ordered by degree then value
+    @param i_count: number of polynomials
+    @return: list of (degree, polynomial as bit mask)
+    '''
+    ls_polys = []
+    i_degree = 1
+    while len(ls_polys) < i_count:
+        for i_poly in range((1 << i_degree) + 1, 1 << (i_degree+1), 2):
+            if _is_primitive(i_poly, i_degree):
+                ls_polys.append((i_degree, i_poly))
+        i_degree += 1
+    return ls_polys[:i_count]
+
+
+def _is_primitive(i_poly, i_degree):
+    ''' x has multiplicative order 2^degree - 1 modulo the polynomial '''
+    i_period = (1 << i_degree) - 1
+    i_rem = 1
+    for k in range(1, i_period+1):
+        i_rem <<= 1
+        if i_rem >> i_degree:
+            i_rem ^= i_poly
+        if i_rem == 1:
+            return k == i_period
+    return False
+
+
+class Sobol(object):
+    ''' Sobol sequence, optionally scrambled (linear matrix scrambling plus a random digital shift) '''
+
+    def __init__(self, i_dims, i_seed=None):
+        '''
+        @summary: constructor, builds the direction numbers of every dimension
+        @param i_dims: number of dimensions
+        @param i_seed: seed of the scrambling, plain Sobol if None
+        '''
+        super(Sobol, self).__init__()
+        self.i_dims = i_dims
+        self.i_seed = i_seed
+
+        # initial direction numbers m_k, odd and below 2^k, fixed once for all
+        init = np.random.RandomState(9878)
+        ar_V = np.zeros((i_dims, I_BITS), dtype=np.uint64)
+        ar_V[0] = [1 << (I_BITS-1-b) for b in range(I_BITS)]
+        for d, (s, i_poly) in enumerate(primitive_polynomials(i_dims-1), 1):
+            ls_m = [2*init.randint(0, 1 << (k-1)) + 1 for k in range(1, s+1)]
+            for b in range(I_BITS):
+                if b < s:
+                    ar_V[d, b] = ls_m[b] << (I_BITS-1-b)
+                else:
+                    i_v = int(ar_V[d, b-s]) ^ (int(ar_V[d, b-s]) >> s)
+                    for k in range(1, s):
+                        if (i_poly >> (s-k)) & 1:
+                            i_v ^= int(ar_V[d, b-k])
+                    ar_V[d, b] = i_v
+
+        # scrambling: lower triangular binary matrix on the digits, then a digital shift
+        self.ar_shift = np.zeros(i_dims, dtype=np.uint64)
+        if i_seed is not None:
+            rng     = np.random.RandomState(i_seed)
+            ar_pows = np.uint64(1) << np.arange(I_BITS-1, -1, -1).astype(np.uint64)
+            for d in range(i_dims):
+                ar_L = np.tril(rng.randint(0, 2, (I_BITS, I_BITS)), -1) + np.eye(I_BITS, dtype=int)
+                ar_digits = ((ar_V[d][:, None] >> (I_BITS-1-np.arange(I_BITS)).astype(np.uint64)) & np.uint64(1)).astype(int)
+                ar_V[d] = (ar_digits.dot(ar_L.T) % 2).astype(np.uint64).dot(ar_pows)
+            self.ar_shift = rng.randint(0, 1 << 16, (i_dims, 2)).astype(np.uint64)
+            self.ar_shift = (self.ar_shift[:, 0] << np.uint64(16)) | self.ar_shift[:, 1]
+        self.ar_V = ar_V
+
+    def draw(self, i_points, i_skip=0):
+        '''
+        @summary: points i_skip, ..., i_skip+i_points-1 of the sequence, in Gray code order
+        @param i_points: number of points
+        @param i_skip: index of the first point
+        @return: uniforms in (0, 1), array of shape (i_points, i_dims)
+        '''
+        ar_index = np.arange(i_skip, i_skip+i_points, dtype=np.uint64)
+        ar_gray  = ar_index ^ (ar_index >> np.uint64(1))
+        ar_x     = np.tile(self.ar_shift, (i_points, 1))
+        for b in range(I_BITS):
+            ar_bit = ((ar_gray >> np.uint64(b)) & np.uint64(1)).astype(bool)
+            ar_x[ar_bit] ^= self.ar_V[:, b]
+        return (ar_x.astype(float) + 0.5) / 2.0**I_BITS
+
+
+class BrownianBridge(object):
+    ''' Brownian bridge on a uniform grid, the first normals fix the coarsest features of the path '''
+
+    def __init__(self, i_steps):
+        '''
+        @summary: constructor, the order in which the bridge fills the grid
+        @param i_steps: number of time steps
+        '''
+        super(BrownianBridge, self).__init__()
+        self.i_steps = i_steps
+        ar_t   = np.arange(1., i_steps+1)
+        ar_map = np.zeros(i_steps, dtype=bool)
+        self.ls_plan = [(i_steps-1, -1, -1, 0., 0., np.sqrt(ar_t[-1]))]
+        ar_map[-1] = True
+        j = 0
+        for i in range(1, i_steps):
+            while ar_map[j]:
+                j += 1
+            k = j
+            while not ar_map[k]:
+                k += 1
+            l = j + ((k-1-j) >> 1)
+            ar_map[l] = True
+            f_left = ar_t[j-1] if j else 0.
+            f_span = ar_t[k] - f_left
+            self.ls_plan.append((l, j-1, k, (ar_t[k]-ar_t[l])/f_span, (ar_t[l]-f_left)/f_span,
+                                 np.sqrt((ar_t[l]-f_left)*(ar_t[k]-ar_t[l])/f_span)))
+            j = k + 1
+            if j >= i_steps:
+                j = 0
+
+    def normals(self, ar_z):
+        '''
+        @summary: map independent normals to the normalized increments of bridged paths
+        @param ar_z: standard normals, shape (paths, i_steps, ...), the bridge runs along axis 1
+        @return: array of the same shape, increments divided by sqrt(dt)
+        '''
+        ar_W = np.empty_like(ar_z)
+        for i, (l, j, k, f_lw, f_rw, f_std) in enumerate(self.ls_plan):
+            ar_W[:, l] = f_std * ar_z[:, i]
+            if k >= 0:
+                ar_W[:, l] += f_rw * ar_W[:, k]
+            if j >= 0:
+                ar_W[:, l] += f_lw * ar_W[:, j]
+        return np.concatenate([ar_W[:, :1], np.diff(ar_W, axis=1)], axis=1)
+
+
+class SobolStream(object):
+    '''
+    Drop-in replacement of a random stream for Libor_Market: standard_normal returns Sobol
+    points mapped to normals and arranged along the time steps by a Brownian bridge.
+    Successive calls consume successive points of the sequence.
+    '''
+
+    def __init__(self, i_seed=None, i_skip=0):
+        '''
+        @summary: constructor
+        @param i_seed: seed of the scrambling, plain Sobol if None (then the origin is skipped)
+        @param i_skip: index of the first point to consume
+        '''
+        super(SobolStream, self).__init__()
+        self.i_seed   = i_seed
+        self.i_next   = i_skip + (1 if i_seed is None else 0)
+        self.d_sobol  = {}
+        self.d_bridge = {}
+
+    def standard_normal(self, t_size):
+        '''
+        @summary: next points as bridged standard normals
+        @param t_size: (paths, steps) or (paths, steps, factors), with factors sharing each bridge
+                       level so that the leading Sobol dimensions drive the coarsest path features
+        '''
+        i_paths, i_steps = t_size[0], t_size[1]
+        i_dims = int(np.prod(t_size[1:]))
+        if i_dims not in self.d_sobol:
+            self.d_sobol[i_dims] = Sobol(i_dims, self.i_seed)
+        if i_steps not in self.d_bridge:
+            self.d_bridge[i_steps] = BrownianBridge(i_steps)
+        ar_u = self.d_sobol[i_dims].draw(i_paths, self.i_next)
+        self.i_next += i_paths
+        return self.d_bridge[i_steps].normals(ndtri(ar_u).reshape(t_size))
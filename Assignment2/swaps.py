@@ -4,7 +4,21 @@ Description: Swap rates
 Author: Weiyi Chen, Wei Liu, Xiaoyu Zhang
 """
 
+# python imports
+import multiprocessing
+import time
+
+# 3rd party imports
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+# local imports
 from libor_market import Libor_Market
+from estimators import RunningMoments
+from qmc import SobolStream
+
+# drivers of the Brownian increments: pseudo random numbers, or scrambled Sobol points through a Brownian bridge
+ls_drivers = ['mc', 'sobol']
 
 class Swap(object):
     ''' Swap object '''
@@ -129,7 +143,7 @@ class BasisSwap(Swap):
 
 class Knock_Out_Swap(Swap):
     ''' Knock Out Swap object derived from Swap '''
-    def __init__(self, ls_init, f_fixedRate=0.0218233230043, f_notional=100, f_maturity=10, i_MC=2000, f_barrier=0.0095, b_frozenCurve=False):
+    def __init__(self, ls_init, f_fixedRate=0.0218233230043, f_notional=100, f_maturity=10, i_MC=2000, f_barrier=0.0095, b_frozenCurve=False, i_batch=1000, i_seed=None, i_workers=1, b_antithetic=False, b_control=False, s_driver='mc', f_tolerance=None, f_timeBudget=None, f_confidence=0.95, ar_corr=None, i_factors=1, ar_vols=None, f_smoothing=0.0005):
         '''
         @summary: Constructor
         @param ls_init: initial list of values for Libor Market Model
@@ -139,7 +153,25 @@ class Knock_Out_Swap(Swap):
         @param i_MC: Monte Carlo Number
         @param f_barrier: knock out barrier 
         @param b_frozenCurve: whether to use frozen curve
+        @param i_batch: number of paths simulated together, the chunk handed to a worker
+        @param i_seed: seed of the per-chunk random streams, drawn once from the global np.random stream if None
+                       so that simulate and simulate_deltas see the same paths
+        @param i_workers: number of worker processes
+        @param b_antithetic: whether to simulate antithetic pairs of Brownian increments
+        @param b_control: whether to use the Brownian path on the fixed coupon dates as control variates,
+                          its square minus the time with b_antithetic since the pairs average odd terms out
+        @param s_driver: one of ls_drivers, with 'sobol' i_seed seeds the scrambling (plain Sobol if None) and chunks take
+                         consecutive blocks of the sequence, i_MC and i_batch are best powers of two;
+                         the standard errors then assume independent paths and are conservative
+        @param f_tolerance: if given, stop after the first chunk where the half-width of the confidence
+                            interval on the break-even rate is below it, i_MC is then a maximum
+        @param f_timeBudget: if given, stop after the first chunk finishing past this many seconds
+        @param f_confidence: confidence level of the interval compared to f_tolerance
+        @param ar_corr, i_factors, ar_vols: correlation, number of factors and volatilities of the Libor_Market
+        @param f_smoothing: width of the normal cdf replacing the barrier indicator for the pathwise deltas
         '''
+        if s_driver not in ls_drivers:
+            raise TypeError('The parameter s_driver can only be: ' + ', '.join(ls_drivers))
 
         # swap paramters
         self.f_fixedRate = f_fixedRate
@@ -147,14 +179,41 @@ class Knock_Out_Swap(Swap):
         self.f_notional  = f_notional
 
         # monte carlo paramters
-        self.i_MC = i_MC
+        self.i_MC      = i_MC
+        self.i_batch   = i_batch
+        self.i_seed    = np.random.randint(2**31) if i_seed is None and s_driver == 'mc' else i_seed
+        self.i_workers = i_workers
+        self.s_driver  = s_driver
+
+        # streaming, stop on the accuracy of the break-even rate or on the time spent
+        self.f_tolerance  = f_tolerance
+        self.f_timeBudget = f_timeBudget
+        self.f_confidence = f_confidence
+        self.i_paths      = 0
+        self.moments      = None
+
+        # pathwise deltas to the initial forwards, smoothed barrier
+        self.f_smoothing        = f_smoothing
+        self.f_kos_value_smooth = 0
+        self.ar_deltas          = None
+        self.ar_deltas_se       = None
+        self.b_simulateDeltas   = False
+
+        # variance reduction, antithetic pairs must not straddle two chunks
+        self.b_antithetic = b_antithetic
+        self.b_control    = b_control
+        if b_antithetic:
+            self.i_batch += self.i_batch % 2
 
         # Knock out paramters
         self.f_barrier      = f_barrier
         self.f_kos_rate     = 0
         self.f_kos_value    = 0
+        self.f_kos_rate_se  = 0
+        self.f_kos_value_se = 0
         self.b_simulatePool = False
-        self.Libor_Market   = Libor_Market(ls_init,int(2*self.f_maturity*4.0), b_frozenCurve=b_frozenCurve)
+        self.Libor_Market   = Libor_Market(ls_init,int(2*self.f_maturity*4.0), b_frozenCurve=b_frozenCurve,
+                                           ar_corr=ar_corr, i_factors=i_factors, ar_vols=ar_vols)
         
 
     def simulate(self):
@@ -163,30 +222,156 @@ class Knock_Out_Swap(Swap):
         @return: None, update f_kos_rate and f_kos_value
         '''
 
-        # tmp value to run simulation
-        tmp_value     = 0.0
-        tmp_float_leg = 0.0
-        tmp_annuity   = 0.0
-        tmp_swap_rate = 0.0
-
-        # MC simulation
-        for i in range(0,self.i_MC):
-            self.Libor_Market.simulate()
-            tmp_swap       = self.init_swap(self.Libor_Market.ls)
-            tmp_value     += self.f_notional*(self.f_fixedRate*tmp_swap[0]-tmp_swap[1])
-            tmp_annuity   += tmp_swap[0]
-            tmp_float_leg += tmp_swap[1]
-            tmp_swap_rate += tmp_swap[1]/tmp_swap[0]
-
-        # Average knock out swap value
-        self.f_kos_value = tmp_value/self.i_MC
-        test_Swap_val    = self.f_notional*(self.f_fixedRate*tmp_annuity-tmp_float_leg) / self.i_MC
-        KOS_par_rate     = tmp_float_leg / tmp_annuity
-
-        # Average knock out swap rate
-        self.f_kos_rate = KOS_par_rate
+        it_results = self.map_chunks(_simulate_chunk)
+        try:
+            self.accumulate(it_results)
+        finally:
+            it_results.close()
         self.b_simulatePool = True
 
+
+    def simulate_deltas(self):
+        '''
+        @summary: pathwise deltas of the value to every initial forward in one pass, on the paths of simulate
+        @return: None, update ar_deltas, ar_deltas_se and f_kos_value_smooth, the value with the smoothed barrier
+        '''
+        moments = None
+        for ar_value, ar_dvalue in self.map_chunks(_delta_chunk):
+            ar_samples = self.pairs(np.column_stack([ar_value, ar_dvalue]))
+            if moments is None:
+                moments = RunningMoments(ar_samples.shape[1])
+            moments.update(ar_samples)
+        self.f_kos_value_smooth = moments.ar_mean[0]
+        self.ar_deltas          = moments.ar_mean[1:]
+        self.ar_deltas_se       = np.sqrt(np.diag(moments.covariance())[1:] / moments.i_count)
+        self.b_simulateDeltas   = True
+
+
+    def map_chunks(self, f_chunk):
+        '''
+        @summary: run f_chunk on every chunk, i_batch paths each on its own stream
+        @param f_chunk: module level function of (Knock_Out_Swap object, chunk index, number of paths)
+        @return: generator of the results in chunk order, so that they do not depend on the number
+                 of workers, closing it early stops the workers
+        '''
+        ls_chunks = [(self, i_start // self.i_batch, min(self.i_batch, self.i_MC-i_start)) for i_start in range(0, self.i_MC, self.i_batch)]
+        if self.i_workers > 1:
+            pool = multiprocessing.Pool(self.i_workers)
+            try:
+                for t_result in pool.imap(f_chunk, ls_chunks, chunksize=1):
+                    yield t_result
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for t_chunk in ls_chunks:
+                yield f_chunk(t_chunk)
+
+
+    def estimate(self, ar_annuity, ar_floatLeg, ar_controls):
+        '''
+        @summary: knock out swap value and rate with their standard errors, from all paths at once
+        @param ar_annuity: annuity of every path
+        @param ar_floatLeg: float leg of every path
+        @param ar_controls: control variates of every path, zero mean, shape (paths, controls)
+        @return: None, update f_kos_value, f_kos_rate and their standard errors
+        '''
+        self.accumulate([(ar_annuity, ar_floatLeg, ar_controls)])
+
+
+    def accumulate(self, it_results):
+        '''
+        @summary: merge chunk results in order into running moments, re-estimating after each chunk
+        @param it_results: iterable of (ar_annuity, ar_floatLeg, ar_controls), consumed lazily,
+                           so that stopping early skips the remaining chunks
+        @return: None, update moments, i_paths, f_kos_value, f_kos_rate and their standard errors
+        '''
+        f_start      = time.time()
+        self.moments = None
+        self.i_paths = 0
+        for ar_annuity, ar_floatLeg, ar_controls in it_results:
+            ar_samples = self.samples(ar_annuity, ar_floatLeg, ar_controls)
+            if self.moments is None:
+                self.moments = RunningMoments(ar_samples.shape[1])
+            self.moments.update(ar_samples)
+            self.i_paths += len(ar_annuity)
+            self.publish()
+            if self.converged(time.time()-f_start):
+                break
+
+
+    def samples(self, ar_annuity, ar_floatLeg, ar_controls):
+        ''' independent samples [annuity, float leg, controls...] '''
+        return self.pairs(np.column_stack([ar_annuity, ar_floatLeg, ar_controls]))
+
+
+    def pairs(self, ar_samples):
+        ''' antithetic pairs of path samples are averaged into one independent sample '''
+        if self.b_antithetic:
+            ar_pairs   = np.arange(len(ar_samples)) // 2
+            ar_samples = np.array([np.bincount(ar_pairs, weights=ar) for ar in ar_samples.T]).T / np.bincount(ar_pairs)[:, None]
+        return ar_samples
+
+
+    def publish(self):
+        '''
+        @summary: knock out swap value and rate with their standard errors from the running moments
+        @return: None, update f_kos_value, f_kos_rate and their standard errors
+        '''
+        i_samples   = self.moments.i_count
+        ar_legs     = self.moments.ar_mean[:2]
+        ar_comoment = self.moments.ar_comoment
+
+        # control variates: regression beta from the co-moments, subtract beta times their known zero mean,
+        # only once there are more samples than regression coefficients, until then the plain estimate
+        ar_legsCom = ar_comoment[:2, :2]
+        i_controls = len(ar_comoment) - 2
+        if i_controls and i_samples < i_controls + 2:
+            i_controls = 0
+        if i_controls:
+            ar_beta    = np.linalg.lstsq(ar_comoment[2:, 2:], ar_comoment[2:, :2], rcond=None)[0]
+            ar_legs    = ar_legs - self.moments.ar_mean[2:].dot(ar_beta)
+            ar_legsCom = ar_legsCom - ar_comoment[:2, 2:].dot(ar_beta)
+        ar_cov = ar_legsCom / max(i_samples-1-i_controls, 1)
+
+        # Average knock out swap value and rate, delta method for the ratio
+        f_annuity, f_floatLeg = ar_legs
+        ar_value = np.array([self.f_fixedRate, -1.0])
+        self.f_kos_value    = self.f_notional*(self.f_fixedRate*f_annuity-f_floatLeg)
+        self.f_kos_rate     = f_floatLeg / f_annuity
+        ar_rate  = np.array([-self.f_kos_rate, 1.0])
+        self.f_kos_value_se = self.f_notional * np.sqrt(ar_value.dot(ar_cov).dot(ar_value) / i_samples)
+        self.f_kos_rate_se  = np.sqrt(ar_rate.dot(ar_cov).dot(ar_rate) / i_samples) / f_annuity
+
+
+    def converged(self, f_elapsed):
+        '''
+        @summary: stopping rule of the streaming mode, never met unless f_tolerance or f_timeBudget is set
+        @param f_elapsed: seconds since the simulation started
+        '''
+        if self.f_timeBudget is not None and f_elapsed >= self.f_timeBudget:
+            return True
+        if self.f_tolerance is None or self.moments.i_count < 2:
+            return False
+        return ndtri(0.5 + 0.5*self.f_confidence) * self.f_kos_rate_se < self.f_tolerance
+
+
+    def controls(self, ar_normals):
+        '''
+        @summary: Brownian paths W on the fixed coupon dates, the linear part of the swap legs, known zero mean;
+                  with antithetic pairs W is odd and averages to zero, W^2 - t is used instead
+        @param ar_normals: standard normals driving the paths, one Brownian path per factor
+        @return: array of shape (paths, controls), no columns unless b_control
+        '''
+        if not self.b_control:
+            return np.zeros((len(ar_normals), 0))
+        f_t  = self.Libor_Market.f_t
+        ar_W = np.cumsum(np.sqrt(f_t)*ar_normals, axis=1)[:, 1:int(4.0*self.f_maturity):2]
+        if self.b_antithetic:
+            ar_times = f_t * np.arange(2., 2.*ar_W.shape[1]+1, 2.)
+            ar_W     = ar_W**2 - ar_times.reshape((1, -1) + (1,)*(ar_W.ndim-2))
+        return ar_W.reshape(len(ar_W), -1)
+
     
     def swap_rate(self):
         ''' handy function to return calculated cache value '''
@@ -200,42 +385,263 @@ class Knock_Out_Swap(Swap):
         if self.b_simulatePool == False:
             self.simulate()
         return self.f_kos_value
+
+
+    def standard_errors(self):
+        ''' handy function to return the standard errors of swap_value and swap_rate '''
+        if self.b_simulatePool == False:
+            self.simulate()
+        return self.f_kos_value_se, self.f_kos_rate_se
+
+
+    def deltas(self):
+        ''' handy function to return the deltas to the initial forwards and their standard errors '''
+        if self.b_simulateDeltas == False:
+            self.simulate_deltas()
+        return self.ar_deltas, self.ar_deltas_se
         
     
     def init_swap(self,L):
         ''' swap initialization with only one path '''
+        ar_annuity, ar_floatLeg, ar_knockOut = self.init_swaps(np.asarray(L)[None])
+        return ar_annuity[0], ar_floatLeg[0], ar_knockOut[0]
+
+
+    def init_swaps(self, ar_paths):
+        '''
+        @summary: swap initialization for a batch of paths at once
+        @param ar_paths: array of shape (paths, rows, columns) from Libor_Market.simulate_paths
+        @return: (ar_annuity, ar_floatLeg, ar_knockOut), one entry per path
+        '''
+        payoff = Knock_Out_Payoff(self, len(ar_paths))
+        for i in range(payoff.i_rows):
+            payoff(i, ar_paths[:, i])
+        return payoff.result()
+
+
+    def chunk_stream(self, i_chunk):
+        '''
+        @summary: independent random stream of one chunk, derived from i_seed and the chunk index
+        @param i_chunk: chunk index
+        @return: np.random.Generator where SeedSequence is available, else np.random.RandomState,
+                 or for the sobol driver the block of the sequence starting at the chunk
+        '''
+        if self.s_driver == 'sobol':
+            i_points = self.i_batch // 2 if self.b_antithetic else self.i_batch
+            return SobolStream(self.i_seed, i_chunk*i_points)
+        if hasattr(np.random, 'SeedSequence'):
+            return np.random.Generator(np.random.PCG64(np.random.SeedSequence(self.i_seed, spawn_key=(i_chunk,))))
+        return np.random.RandomState([self.i_seed, i_chunk])
+
 
-        # knock out case
-        for n in range(1, int(self.f_maturity * 2.0)):
-            if self.swap_rate_t(n,L) < self.f_barrier:
-                f_floatLeg = sum([(1.0/4.0) * L[i][0] * self.disc_factor(L, float(i+1)/4.0) for i in range(int(4.0*n/2.0))])
-                f_annuity = sum([(1.0/2.0)*self.disc_factor(L, float(i+1)/2.0) for i in range(n)])
-                return f_annuity, f_floatLeg, 1
-
-        # No knock out occurs in this path
-        f_floatLeg = sum([(1.0/4.0)*L[i][0]*self.disc_factor(L, float(i+1)/4.0) for i in range(int(4.0*self.f_maturity))])
-        f_annuity = sum([(1.0/2.0)*self.disc_factor(L, float(i+1)/2.0) for i in range(0,int(2.0*self.f_maturity))])
-        return f_annuity, f_floatLeg, 0
+    def disc_curve(self, ar_rows):
+        '''
+        @summary: discount curve of simulated rows by prefix products of (1 + L/4)
+        @param ar_rows: forwards along the last axis, any leading shape
+        @return: array with one more column, [..., k] = 1 / prod_{j<k} (1 + L[..., j]/4)
+        '''
+        ar_rows = np.asarray(ar_rows, dtype=float)
+        ar_ones = np.ones(ar_rows.shape[:-1] + (1,))
+        return 1.0 / np.concatenate([ar_ones, np.cumprod(1+1.0/4.0*ar_rows, axis=-1)], axis=-1)
     
 
     def disc_factor(self,L,T,s=0):
         ''' discount factor by using LIBOR fwd '''
-        result = 1.
-        for i in range(int(4.0*s),int(4.0*T)):
-            result *= 1+1.0/4.0*L[i][0]
-        return 1.0/result/self.disc_factor_t(int(T*4.0)-1, L, T)
+        ar_spot = self.disc_curve([L[i][0] for i in range(int(4.0*T))])
+        return ar_spot[int(4.0*T)]/ar_spot[int(4.0*s)]/self.disc_factor_t(int(T*4.0)-1, L, T)
     
 
     def disc_factor_t(self,i,L,T,s=0):
         ''' discount factor by using LIBOR fwd at time t'''
-        result = 1.
-        for j in range(int(4.0*s),int(4.0*T)):
-            result *= 1+1.0/4.0*L[i][j]
-        return 1.0/result
+        ar_curve = self.disc_curve(L[i][:int(4.0*T)])
+        return ar_curve[int(4.0*T)]/ar_curve[int(4.0*s)]
     
 
     def swap_rate_t(self,i,L):
         ''' swap rate of knock-out swap at time t'''
-        f_floatLeg = sum([(1.0/4.0)*L[i][j]*self.disc_factor_t(i,L, float(j+1)/4.0) for j in range(int(4.0*self.f_maturity))])
-        f_annuity = sum([(1.0/2.0)*self.disc_factor_t(i,L, float(j+1)/2.0) for j in range(int(2.0*self.f_maturity))])
+        ar_curve   = self.disc_curve(L[i][:int(4.0*self.f_maturity)])
+        f_floatLeg = np.sum((1.0/4.0)*np.asarray(L[i][:int(4.0*self.f_maturity)])*ar_curve[1:])
+        f_annuity  = np.sum((1.0/2.0)*ar_curve[2::2])
         return f_floatLeg / f_annuity
+
+
+class Knock_Out_Payoff(object):
+    '''
+    Consumer of the rows of simulated paths for Knock_Out_Swap, to be passed as the f_row of
+    Libor_Market.simulate_paths. Per path it keeps only the fixings, one discount factor per
+    row and the swap rates on the fixed coupon dates, never the paths themselves.
+    '''
+    def __init__(self, kos, i_paths):
+        '''
+        @summary: constructor
+        @param kos: Knock_Out_Swap object
+        @param i_paths: number of paths
+        '''
+        super(Knock_Out_Payoff, self).__init__()
+        self.kos     = kos
+        self.i_float = int(4.0*kos.f_maturity)
+        self.i_fixed = int(2.0*kos.f_maturity)
+        self.i_rows  = self.i_float
+
+        self.ar_fixings = np.zeros((i_paths, self.i_float))
+        self.ar_diag    = np.ones((i_paths, self.i_float))
+        self.ar_rates   = np.zeros((i_paths, self.i_fixed-1))
+
+
+    def __call__(self, i, ar_row):
+        '''
+        @summary: consume row i of every path, rows past i_rows are not read
+        @param i: row index
+        @param ar_row: forwards of the row, shape (paths, live forwards)
+        '''
+        if i >= self.i_rows:
+            return
+        ar_row   = ar_row[:, :self.i_float]
+        ar_curve = self.kos.disc_curve(ar_row)
+        self.ar_fixings[:, i] = ar_row[:, 0]
+        self.ar_diag[:, i]    = ar_curve[:, i+1]
+
+        # swap rate on the fixed coupon dates
+        if 1 <= i < self.i_fixed:
+            self.ar_rates[:, i-1] = np.sum((1.0/4.0) * ar_row * ar_curve[:, 1:], axis=1) \
+                                  / np.sum((1.0/2.0) * ar_curve[:, 2::2], axis=1)
+
+
+    def result(self):
+        '''
+        @summary: legs of every path once all rows are consumed
+        @return: (ar_annuity, ar_floatLeg, ar_knockOut), one entry per path
+        '''
+        # numeraire-adjusted discount factors disc_factor(L, k/4), k = 1..i_float
+        ar_spot = self.kos.disc_curve(self.ar_fixings)[:, 1:]
+        ar_disc = ar_spot / self.ar_diag
+
+        # legs accrued up to every quarter, resp. every fixed coupon date
+        ar_floatLegs = np.cumsum((1.0/4.0) * self.ar_fixings * ar_disc, axis=1)
+        ar_annuities = np.cumsum((1.0/2.0) * ar_disc[:, 1::2], axis=1)
+
+        # knocked out at the first fixed coupon date with the swap rate below the barrier
+        ar_below    = self.ar_rates < self.kos.f_barrier
+        ar_knockOut = ar_below.any(axis=1).astype(int)
+        ar_n        = np.where(ar_knockOut, np.argmax(ar_below, axis=1) + 1, self.i_fixed)
+
+        ar_paths = np.arange(len(ar_disc))
+        return ar_annuities[ar_paths, ar_n-1], ar_floatLegs[ar_paths, 2*ar_n-1], ar_knockOut
+
+
+class Knock_Out_Delta(Knock_Out_Payoff):
+    '''
+    Knock_Out_Payoff also keeping the rows it reads, for pathwise deltas to the initial forwards by a
+    reverse sweep (Libor_Market.adjoint). The barrier indicator is smoothed into a normal cdf so that
+    the pathwise derivative of the value exists.
+    '''
+    def __init__(self, kos, i_paths):
+        '''
+        @summary: constructor
+        @param kos: Knock_Out_Swap object
+        @param i_paths: number of paths
+        '''
+        super(Knock_Out_Delta, self).__init__(kos, i_paths)
+        self.ls_rows = []
+
+
+    def __call__(self, i, ar_row):
+        ''' consume row i of every path and keep it for the reverse sweep '''
+        super(Knock_Out_Delta, self).__call__(i, ar_row)
+        if i < self.i_rows:
+            self.ls_rows.append(ar_row)
+
+
+    def smoothed(self, f_smoothing):
+        '''
+        @summary: value with the smoothed barrier and its gradient, once all rows are consumed
+        @param f_smoothing: width of the normal cdf, the probability of being knocked out on a
+                            fixed coupon date is N((barrier - swap rate) / f_smoothing)
+        @return: (ar_value, ar_dvalue), of shapes (paths,) and (paths, initial forwards)
+        '''
+        ar_fix   = self.ar_fixings
+        ar_spot  = self.kos.disc_curve(ar_fix)[:, 1:]
+        ar_disc  = ar_spot / self.ar_diag
+        ar_float = np.cumsum((1.0/4.0) * ar_fix * ar_disc, axis=1)[:, 1::2]
+        ar_ann   = np.cumsum((1.0/2.0) * ar_disc[:, 1::2], axis=1)
+
+        # probability of stopping on every fixed coupon date, the last one takes the paths never knocked out
+        ar_x     = (self.kos.f_barrier - self.ar_rates) / f_smoothing
+        ar_p     = ndtr(ar_x)
+        ar_alive = np.column_stack([np.ones(len(ar_fix)), np.cumprod(1.0-ar_p, axis=1)])
+        ar_w     = np.column_stack([ar_alive[:, :-1]*ar_p, ar_alive[:, -1]])
+
+        f_notional, f_fixedRate = self.kos.f_notional, self.kos.f_fixedRate
+        ar_value = f_notional * np.sum(ar_w * (f_fixedRate*ar_ann - ar_float), axis=1)
+
+        # reverse sweep, stopping weights
+        ar_barW     = f_notional * (f_fixedRate*ar_ann - ar_float)
+        ar_barP     = np.zeros_like(ar_p)
+        ar_barAlive = ar_barW[:, -1]
+        for n in range(ar_p.shape[1]-1, -1, -1):
+            ar_barP[:, n] = ar_alive[:, n] * (ar_barW[:, n] - ar_barAlive)
+            ar_barAlive   = ar_barW[:, n]*ar_p[:, n] + ar_barAlive*(1.0-ar_p[:, n])
+        ar_barRates = -ar_barP * np.exp(-0.5*ar_x*ar_x) / np.sqrt(2.0*np.pi) / f_smoothing
+
+        # legs, discount factors and fixings
+        ar_barDisc = np.zeros_like(ar_disc)
+        ar_barDisc[:, 1::2] = (1.0/2.0) * _suffix_sum(f_notional*f_fixedRate*ar_w)
+        ar_barCum  = np.zeros_like(ar_disc)
+        ar_barCum[:, 1::2] = -f_notional * ar_w
+        ar_barCum  = _suffix_sum(ar_barCum)
+        ar_barDisc += (1.0/4.0) * ar_fix * ar_barCum
+        ar_barFix  = (1.0/4.0) * ar_disc * ar_barCum
+        ar_barDiag = -ar_barDisc * ar_disc / self.ar_diag
+        ar_barFix -= (1.0/4.0) / (1.0 + (1.0/4.0)*ar_fix) * _suffix_sum(ar_barDisc / self.ar_diag * ar_spot)
+
+        # rows, through the fixings, the diagonal discount factors and the swap rates
+        ls_bars = []
+        for i, ar_row in enumerate(self.ls_rows):
+            ar_bar = np.zeros_like(ar_row)
+            ar_r   = ar_row[:, :self.i_float]
+            ar_dlog = (1.0/4.0) / (1.0 + (1.0/4.0)*ar_r)
+            ar_bar[:, 0] += ar_barFix[:, i]
+            ar_bar[:, :i+1] -= (ar_barDiag[:, i] * self.ar_diag[:, i])[:, None] * ar_dlog[:, :i+1]
+            if 1 <= i < self.i_fixed:
+                ar_curve = self.kos.disc_curve(ar_r)
+                f_den    = np.sum((1.0/2.0) * ar_curve[:, 2::2], axis=1)
+                ar_barNum = ar_barRates[:, i-1] / f_den
+                ar_barCurve = np.zeros_like(ar_curve)
+                ar_barCurve[:, 1:]   += (1.0/4.0) * ar_r * ar_barNum[:, None]
+                ar_barCurve[:, 2::2] -= (1.0/2.0) * (ar_barNum * self.ar_rates[:, i-1])[:, None]
+                ar_bar[:, :self.i_float] += (1.0/4.0) * ar_curve[:, 1:] * ar_barNum[:, None] \
+                                          - ar_dlog * _suffix_sum(ar_barCurve * ar_curve)[:, 1:]
+            ls_bars.append(ar_bar)
+
+        return ar_value, self.kos.Libor_Market.adjoint(self.ls_rows, ls_bars)
+
+
+def _suffix_sum(ar):
+    ''' sums over the columns from each one to the last '''
+    return np.cumsum(ar[:, ::-1], axis=1)[:, ::-1]
+
+
+def _simulate_chunk(t_chunk):
+    '''
+    @summary: simulate one chunk of paths, module level so that worker processes can run it
+    @param t_chunk: (Knock_Out_Swap object, chunk index, number of paths)
+    @return: (ar_annuity, ar_floatLeg, ar_controls) of every path in the chunk
+    '''
+    kos, i_chunk, i_paths = t_chunk
+    ar_normals = kos.Libor_Market.normals(i_paths, kos.chunk_stream(i_chunk), kos.b_antithetic)
+    payoff     = Knock_Out_Payoff(kos, i_paths)
+    kos.Libor_Market.simulate_paths(i_paths, ar_normals, f_row=payoff, i_rows=payoff.i_rows)
+    return payoff.result()[:2] + (kos.controls(ar_normals),)
+
+
+def _delta_chunk(t_chunk):
+    '''
+    @summary: pathwise deltas of one chunk of paths, on the same normals as _simulate_chunk
+    @param t_chunk: (Knock_Out_Swap object, chunk index, number of paths)
+    @return: (ar_value, ar_dvalue) of every path in the chunk, with the smoothed barrier
+    '''
+    kos, i_chunk, i_paths = t_chunk
+    ar_normals = kos.Libor_Market.normals(i_paths, kos.chunk_stream(i_chunk), kos.b_antithetic)
+    payoff     = Knock_Out_Delta(kos, i_paths)
+    kos.Libor_Market.simulate_paths(i_paths, ar_normals, f_row=payoff, i_rows=payoff.i_rows)
+    return payoff.smoothed(kos.f_smoothing)